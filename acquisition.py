@@ -0,0 +1,382 @@
+"""
+Producer-consumer split of the host-timed acquisition loops.
+
+HostAcquisition runs the instrument side in its own thread: pulse edges from
+a PulseScheduler, the query and the timestamp, nothing else. Raw samples go
+into a bounded queue. The procedure thread consumes them in blocks with
+blocks(), integrates charge, stores, writes and emits, so a slow GUI or disk
+no longer delays the next reading or edge. The producer stops itself at
+total_time; should_stop and the charge limit are checked by the consumer at
+least every `interval` seconds and end the producer through stop().
+
+DualAcquisition does the same for the two SMU channels of a 2600, both read
+in one transaction per sample and each with its own pulse timeline.
+
+PlatingLoops is the consumer side shared by the electroplating procedures:
+the pipeline of a run (LoopTimer, EmitStage, SampleStore, ChargeIntegrator),
+the host timed pulse and constant voltage runs and consume(), the one loop
+for blocks of any source, host or instrument timed.
+"""
+
+import logging
+import queue
+import threading
+from functools import partial
+from time import perf_counter
+import numpy as np
+from charge_integrator import ChargeIntegrator
+from emit_stage import EmitStage
+from fast_read import FAST_READERS
+from loop_timing import LoopTimer
+from pulse_scheduler import PulseScheduler
+from sample_store import SampleStore
+
+log = logging.getLogger(__name__)
+
+
+class HostAcquisition(threading.Thread):
+    """Samples read() until total_time, setting edges with set_level().
+
+    read() returns (current, voltage) of one sample. Without a scheduler the
+    source is left alone and every sample is booked as pause (in_pulse False).
+    """
+
+    # Columns of a queued row, the in_pulse columns are booleans
+    COLUMNS = ("time", "current", "voltage", "in_pulse")
+
+    def __init__(
+        self,
+        read,
+        total_time,
+        scheduler=None,
+        set_level=None,
+        pulse_height=None,
+        pause_height=None,
+        timer=None,
+        maxsize=1_000_000,
+        interval=0.05,
+        max_block=10000,
+    ):
+        # Named after the starting thread, the log tells the cells apart
+        name = f"{threading.current_thread().name} acquisition"
+        super().__init__(name=name, daemon=True)
+        self.read = read
+        self.total_time = total_time
+        self.scheduler = scheduler
+        self.set_level = set_level
+        self.pulse_height = pulse_height
+        self.pause_height = pause_height
+        self.timer = timer or LoopTimer(enabled=False)
+        self.interval = interval
+        self.max_block = max_block
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.stopped = threading.Event()
+        self.error = None
+        self.start_time = None
+
+    def run(self):
+        scheduler = self.scheduler
+        in_pulse = False
+        try:
+            # Sample times and the edge timeline share the same origin, taken
+            # here so that setup before the producer starts does not eat into
+            # the first pause
+            self.start_time = perf_counter()
+            if scheduler is not None:
+                scheduler.restart(self.start_time)
+            while not self.stopped.is_set():
+                if scheduler is not None and scheduler.should_wait(perf_counter()):
+                    in_pulse = self.edge(
+                        scheduler, self.set_level, self.pulse_height, self.pause_height
+                    )
+                messt1 = perf_counter()
+                current, voltage = self.read()
+                messt2 = perf_counter()
+                self.timer.iteration(messt1, messt2)
+                if scheduler is not None:
+                    scheduler.record_query(messt2 - messt1)
+                cur_time = perf_counter() - self.start_time - (messt2 - messt1) / 2
+                self.queue.put((cur_time, current, voltage, in_pulse))
+                if cur_time >= self.total_time:
+                    break
+        except Exception as e:
+            self.error = e
+        finally:
+            if scheduler is not None:
+                scheduler.close(perf_counter())
+            self.queue.put(None)
+
+    def edge(self, scheduler, set_level, pulse_height, pause_height):
+        """Waits for the next edge of scheduler, switches the level, returns in_pulse."""
+        scheduler.wait()
+        messt1 = perf_counter()
+        if scheduler.in_pulse:
+            set_level(pause_height)
+        else:
+            set_level(pulse_height)
+        messt2 = perf_counter()
+        in_pulse = scheduler.advance(messt1, messt2)
+        self.timer.record("edge_late", scheduler.late)
+        return in_pulse
+
+    def blocks(self):
+        """Yields one array per column (times, currents, voltages, in_pulse).
+
+        Blocks may be empty, so the caller gets control back every interval
+        even when no samples arrive. Errors of the producer are raised here.
+        """
+        done = False
+        while not done:
+            rows = []
+            try:
+                rows.append(self.queue.get(timeout=self.interval))
+                pending = self.queue.qsize()
+                self.timer.record("pending", pending)
+                for _ in range(min(pending, self.max_block)):
+                    rows.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            if rows and rows[-1] is None:
+                rows.pop()
+                done = True
+            block = np.array(rows, dtype=float).reshape(-1, len(self.COLUMNS))
+            yield tuple(
+                block[:, k].astype(bool) if name.startswith("in_pulse") else block[:, k]
+                for k, name in enumerate(self.COLUMNS)
+            )
+        if self.error is not None:
+            raise self.error
+
+    def stop(self):
+        """Ends the producer and waits for it, discarding unconsumed samples."""
+        self.stopped.set()
+        while self.is_alive():
+            # Unblocks a producer waiting on a full queue
+            try:
+                self.queue.get(timeout=self.interval)
+            except queue.Empty:
+                pass
+        self.join()
+
+
+class DualAcquisition(HostAcquisition):
+    """Samples two channels with one read() until total_time.
+
+    read() returns (current_a, voltage_a, current_b, voltage_b) of one
+    combined transaction. schedulers, pulse_heights and pause_heights are
+    pairs, a None scheduler leaves that channel at its level. set_level(k,
+    level) sets the source of channel k (0 or 1), level None turns it off;
+    finish(k) does that from the consumer side, e.g. at the charge limit,
+    and the other channel keeps running.
+    """
+
+    COLUMNS = (
+        "time",
+        "current_a",
+        "voltage_a",
+        "in_pulse_a",
+        "current_b",
+        "voltage_b",
+        "in_pulse_b",
+    )
+
+    def __init__(
+        self,
+        read,
+        total_time,
+        schedulers=(None, None),
+        set_level=None,
+        pulse_heights=(None, None),
+        pause_heights=(None, None),
+        **kwargs,
+    ):
+        super().__init__(read, total_time, set_level=set_level, **kwargs)
+        self.schedulers = tuple(schedulers)
+        self.pulse_heights = tuple(pulse_heights)
+        self.pause_heights = tuple(pause_heights)
+        self.finished = [threading.Event(), threading.Event()]
+
+    def finish(self, channel):
+        """Turns channel off at the next sample."""
+        self.finished[channel].set()
+
+    def run(self):
+        schedulers = self.schedulers
+        active = [s for s in schedulers if s is not None]
+        in_pulse = [False, False]
+        off = [False, False]
+        try:
+            self.start_time = perf_counter()
+            for scheduler in active:
+                scheduler.restart(self.start_time)
+            while not self.stopped.is_set():
+                for k, scheduler in enumerate(schedulers):
+                    if self.finished[k].is_set():
+                        if not off[k]:
+                            self.set_level(k, None)
+                            off[k] = True
+                    elif scheduler is not None and scheduler.should_wait(
+                        perf_counter()
+                    ):
+                        in_pulse[k] = self.edge(
+                            scheduler,
+                            partial(self.set_level, k),
+                            self.pulse_heights[k],
+                            self.pause_heights[k],
+                        )
+                if all(off):
+                    break
+                messt1 = perf_counter()
+                current_a, voltage_a, current_b, voltage_b = self.read()
+                messt2 = perf_counter()
+                self.timer.iteration(messt1, messt2)
+                for scheduler in active:
+                    scheduler.record_query(messt2 - messt1)
+                cur_time = perf_counter() - self.start_time - (messt2 - messt1) / 2
+                self.queue.put(
+                    (
+                        cur_time,
+                        current_a,
+                        voltage_a,
+                        in_pulse[0],
+                        current_b,
+                        voltage_b,
+                        in_pulse[1],
+                    )
+                )
+                if cur_time >= self.total_time:
+                    break
+        except Exception as e:
+            self.error = e
+        finally:
+            for scheduler in active:
+                scheduler.close(perf_counter())
+            self.queue.put(None)
+
+
+class PlatingLoops:
+    """Consumer side of the electroplating procedures, mixed in before Procedure.
+
+    The procedure sets READER, its key in fast_read.FAST_READERS, and
+    implements meter_current() (one reading in A), meter_set_voltage(voltage)
+    and meter_output_on() for the channel it plates with.
+    """
+
+    READER = None
+    reader = None
+    source_level = 0
+
+    def start_pipeline(self):
+        """Sets up timer, emit stage, sample store and integrator of a run."""
+        self.timer = LoopTimer(enabled=self.timing_report)
+        self.emitter = EmitStage(
+            self,
+            decimation=self.emit_decimation,
+            results_file=self.data_filename,
+            binary=self.binary_results,
+            timer=self.timer,
+        )
+        self.samples = SampleStore(
+            ["Time (s)", "Current (mA)", "Voltage (V)"], max_chunks=32
+        )
+        self.integrator = ChargeIntegrator(self.max_charge)
+
+    def finish_pipeline(self, cur_time):
+        """Closes the pipeline of a run that ended at cur_time."""
+        log.info(f"Plating done, {self.integrator.summary()}")
+        self.emitter.close()
+        self.timer.save(self.data_filename)
+        self.time_offset = self.time_offset + cur_time
+
+    def read_sample(self):
+        """One reading, current in mA.
+
+        Without voltage measurement the voltage is the level last sourced.
+        """
+        if self.reader is not None:
+            mcurrent, mvolt = self.reader.read()
+        else:
+            mcurrent, mvolt = self.meter_current(), None
+        if mvolt is None:
+            mvolt = self.source_level
+        return mcurrent * 1000, mvolt
+
+    def set_source_voltage(self, voltage):
+        self.meter_set_voltage(voltage)
+        self.source_level = voltage
+
+    def pulse_phases(self, volts):
+        """in_pulse of every sample, by the nearer of pulse and pause height."""
+        return np.abs(volts - self.pulse_height) < np.abs(volts - self.pause_height)
+
+    def execute_host_timed(self):
+        """Host timed pulse train, or constant voltage without pulse mode."""
+        if not self.pulse:
+            log.info("Starting constant electroplating")
+            self.set_source_voltage(self.voltage)
+            self.meter_output_on()
+            return self.execute_host()
+        log.info("Starting pulsed electroplating")
+        self.set_source_voltage(self.pause_height)
+        self.meter_output_on()
+        scheduler = PulseScheduler(self.pulse_width / 1000, self.pause_width / 1000)
+        cur_time = self.execute_host(scheduler)
+        log.info(f"Pulses: {scheduler.summary()}")
+        return cur_time
+
+    def execute_host(self, scheduler=None):
+        """Host timed run with the instrument reads in an acquisition thread."""
+        if self.fast_reads or self.measure_voltage:
+            # Voltage and current are read in one transaction
+            self.reader = FAST_READERS[self.READER](
+                self.meter, self.measure_voltage, binary=self.fast_reads
+            )
+            self.reader.configure()
+        acquisition = HostAcquisition(
+            self.read_sample,
+            self.total_time,
+            scheduler,
+            self.set_source_voltage,
+            self.pulse_height,
+            self.pause_height,
+            timer=self.timer,
+        )
+        acquisition.start()
+        try:
+            return self.consume(acquisition.blocks(), pulsed=scheduler is not None)
+        finally:
+            acquisition.stop()
+            if self.reader is not None:
+                self.reader.restore()
+                self.reader = None
+
+    def consume(self, blocks, pulsed=True):
+        """Integrates, stores and emits blocks, returns the last sample time.
+
+        blocks yields (times, currents in mA, voltages, in_pulse) arrays and
+        may yield empty ones. Ends with the blocks, at a stop or at the charge
+        limit; block_done() is called after every block.
+        """
+        cur_time = 0
+        for times, currents, volts, in_pulse in blocks:
+            if len(times):
+                charges = self.integrator.add_block(
+                    times, currents, in_pulse if pulsed else None
+                )
+                self.samples.append_block(times, currents, volts)
+                self.emitter.push_block(
+                    times + self.time_offset, currents, volts, charges
+                )
+                cur_time = times[-1]
+                self.emitter.progress(100 * cur_time / self.total_time)
+            self.block_done(cur_time)
+            if self.should_stop():
+                log.warning("Catch stop command in procedure")
+                break
+            if self.charge_stop and self.integrator.reached:
+                log.info("Maximum Charge reached")
+                break
+        return cur_time
+
+    def block_done(self, cur_time):
+        """Called by consume() after every block."""
@@ -0,0 +1,357 @@
+"""
+Benchmarks the real execute() loops of the procedures on simulated instruments.
+
+Every case runs startup() and execute() of a procedure with a stand-in for the
+pymeasure worker (queued emits, CSV rows written by a recorder thread) across
+a matrix of emit decimation, full-rate recorder backend, raw binary or
+pymeasure reads (fast_read.py) and pulse width; procedures without one of
+these parameters run once per value of the others. The result is a JSON list
+with samples/s, loop period percentiles, pulse-edge error and peak traced
+memory per run. Samples are the acquired ones, logged as they are pushed into
+the EmitStage (sample_times), not the rows left after decimation; HP_Measure
+emits every sample itself, there the recorded rows are the samples:
+
+    python benchmark_acquisition.py --cases constant pulsed --pulse-widths 10 40
+
+Peak memory comes from tracemalloc, which slows the loops down a bit; all
+cases pay the same overhead, so they stay comparable with each other.
+"""
+
+import argparse
+import importlib
+import itertools
+import json
+import logging
+import os
+import queue
+import tempfile
+import threading
+import tracemalloc
+from pathlib import Path
+from time import perf_counter
+import numpy as np
+
+os.environ.setdefault("EP_SIMULATE", "1")
+
+log = logging.getLogger(__name__)
+
+CASES = {
+    "constant": {
+        "module": "electroplating",
+        "procedure": "Electroplating",
+        "parameters": {"pulse": False, "voltage": 0.1},
+    },
+    "pulsed": {
+        "module": "electroplating",
+        "procedure": "Electroplating",
+        "parameters": {"pulse": True},
+    },
+    "pulsed_list": {
+        "module": "electroplating",
+        "procedure": "Electroplating",
+        "parameters": {"pulse": True, "instrument_timed": True},
+    },
+    "pulsed_2450": {
+        "module": "electroplating2470",
+        "procedure": "Electroplating",
+        "parameters": {"pulse": True},
+    },
+    "pulsed_2600": {
+        "module": "electroplating2600",
+        "procedure": "Electroplating",
+        "parameters": {"pulse": True},
+    },
+    "pulsed_tsp": {
+        "module": "electroplating2600",
+        "procedure": "Electroplating",
+        "parameters": {"pulse": True, "instrument_timed": True},
+    },
+    "dual_2600": {
+        "module": "electroplating2600",
+        "procedure": "Electroplating",
+        "parameters": {"pulse": True, "dual_channel": True},
+    },
+    "bubble": {
+        "module": "bubble_plating",
+        "procedure": "BubblePlating",
+        "parameters": {
+            "measure_voltage": True,
+            "start_voltage": 0,
+            "end_voltage": 0.1,
+            "step_size": 0.05,
+            "plating_time": 1,
+            "down_time": 0.5,
+            "rest_interval": 0.1,
+        },
+    },
+    "bubble_rest_full": {
+        "module": "bubble_plating",
+        "procedure": "BubblePlating",
+        "parameters": {
+            "rest_sampling": "Full Rate",
+            "start_voltage": 0,
+            "end_voltage": 0.1,
+            "step_size": 0.05,
+            "plating_time": 1,
+            "down_time": 0.5,
+        },
+    },
+    "bubble_list": {
+        "module": "bubble_plating",
+        "procedure": "BubblePlating",
+        "parameters": {
+            "instrument_timed": True,
+            "start_voltage": 0,
+            "end_voltage": 0.1,
+            "step_size": 0.05,
+            "plating_time": 1,
+            "down_time": 0.5,
+        },
+    },
+    "hp_logging": {
+        "module": "ece34401A",
+        "procedure": "HP_Measure",
+        "parameters": {"measure_voltage": True},
+    },
+}
+
+
+class BenchRecorder:
+    """Stands in for the pymeasure worker and recorder.
+
+    emit() only queues, like the worker does, and a thread formats and writes
+    the CSV rows, like the recorder does.
+    """
+
+    def __init__(self, filename, columns):
+        self.columns = list(columns)
+        self.queue = queue.Queue()
+        self.times = []
+        self.emits = 0
+        self.emit_time = 0.0
+        self.file = open(filename, "w", encoding="utf-8")
+        self.file.write(",".join(self.columns) + "\n")
+        self.thread = threading.Thread(target=self._write, daemon=True)
+        self.thread.start()
+
+    def emit(self, topic, record):
+        start = perf_counter()
+        if topic == "results":
+            self.queue.put(record)
+        self.emits += 1
+        self.emit_time += perf_counter() - start
+
+    def _write(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            self.file.write(",".join(str(record[c]) for c in self.columns) + "\n")
+            self.times.append(record["Time (s)"])
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.file.close()
+
+
+def period_stats(times):
+    """Percentiles of the time between consecutive samples, in ms."""
+    periods = np.diff(np.asarray(times, dtype=float)) * 1000
+    if len(periods) == 0:
+        return {}
+    p50, p90, p99 = np.percentile(periods, [50, 90, 99])
+    return {
+        "period_p50_ms": p50,
+        "period_p90_ms": p90,
+        "period_p99_ms": p99,
+        "period_max_ms": periods.max(),
+    }
+
+
+def edge_stats(edges, pulse_height, pause_height, pulse_width, pause_width):
+    """Achieved vs requested pulse and pause widths from the source edge log."""
+    edges = [(t, v) for t, v in edges if v in (pulse_height, pause_height)]
+    while edges and edges[0][1] != pulse_height:
+        edges.pop(0)
+    if len(edges) < 3:
+        return {}
+    times = np.array([t for t, _ in edges])
+    in_pulse = np.array([v == pulse_height for _, v in edges])
+    requested = np.where(in_pulse[:-1], pulse_width, pause_width) / 1000
+    error = (np.diff(times) - requested) * 1000
+    return {
+        "edges": len(edges),
+        "edge_error_mean_ms": np.abs(error).mean(),
+        "edge_error_max_ms": np.abs(error).max(),
+        "edge_drift_ms": error.sum(),
+    }
+
+
+def source_edges(meter):
+    """Edge log of the simulated cell the procedure drives."""
+    if hasattr(meter, "ChA"):
+        return meter.ChA.cell.edges
+    if hasattr(meter, "cell"):
+        return meter.cell.edges
+    return []
+
+
+def case_class(name):
+    spec = CASES[name]
+    module = importlib.import_module(spec["module"])
+    return getattr(module, spec["procedure"])
+
+
+def settings(procedure_class, parameter, values):
+    """values if procedure_class has parameter, else [None]: one run."""
+    return values if hasattr(procedure_class, parameter) else [None]
+
+
+def run_case(
+    name, decimation, binary, pulse_width, total_time, directory, fast_reads=True
+):
+    """Runs one case; decimation, binary and fast_reads are None if not used."""
+    procedure_class = case_class(name)
+    parameters = dict(CASES[name]["parameters"])
+    parameters.update(
+        total_time=total_time, pulse_width=pulse_width, pause_width=pulse_width
+    )
+    for key, value in [
+        ("emit_decimation", decimation),
+        ("binary_results", binary),
+        ("fast_reads", fast_reads),
+    ]:
+        if hasattr(procedure_class, key):
+            parameters[key] = value
+    pulsed = parameters.get("pulse", False)
+    procedure = procedure_class(**parameters)
+    filename = Path(directory) / (
+        f"{name}_{decimation}_{binary}_{fast_reads}_{pulse_width}.csv"
+    )
+    procedure.data_filename = filename
+    procedure.sample_times = []
+    recorder = BenchRecorder(filename, procedure.DATA_COLUMNS)
+    procedure.emit = recorder.emit
+    procedure.should_stop = lambda: False
+    # The open circuit measurement around a run is not part of the loop
+    procedure.measure_open_voltage = lambda: None
+    procedure.startup()
+
+    tracemalloc.start()
+    try:
+        start = perf_counter()
+        procedure.execute()
+        elapsed = perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        recorder.close()
+
+    if hasattr(procedure_class, "emit_decimation"):
+        times = procedure.sample_times
+    else:
+        times = recorder.times
+    samples = len(times)
+    result = {
+        "case": name,
+        "emit_decimation": parameters.get("emit_decimation"),
+        "binary_results": parameters.get("binary_results"),
+        "fast_reads": parameters.get("fast_reads"),
+        "pulse_width_ms": pulse_width if pulsed else None,
+        "elapsed_s": elapsed,
+        "samples": samples,
+        "samples_per_s": samples / elapsed,
+        "emits": recorder.emits,
+        "emit_mean_us": 1e6 * recorder.emit_time / max(1, recorder.emits),
+        "peak_memory_mb": peak / 2**20,
+    }
+    result.update(period_stats(times))
+    if pulsed:
+        result.update(
+            edge_stats(
+                source_edges(procedure.meter),
+                procedure.pulse_height,
+                procedure.pause_height,
+                pulse_width,
+                pulse_width,
+            )
+        )
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the acquisition loops")
+    parser.add_argument("--cases", nargs="+", choices=list(CASES), default=list(CASES))
+    parser.add_argument("--decimation", nargs="+", type=int, default=[1, 10])
+    parser.add_argument(
+        "--binary",
+        choices=["off", "on", "both"],
+        default="both",
+        help="full-rate binary recorder",
+    )
+    parser.add_argument(
+        "--fast-reads",
+        choices=["off", "on", "both"],
+        default="on",
+        help="raw binary reads instead of the pymeasure properties",
+    )
+    parser.add_argument("--pulse-widths", nargs="+", type=float, default=[10, 40])
+    parser.add_argument("--total-time", type=float, default=5)
+    parser.add_argument("--output", type=Path, default=Path("bench_results.json"))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    switches = {"off": [False], "on": [True], "both": [False, True]}
+    binaries = switches[args.binary]
+    fasts = switches[args.fast_reads]
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name in args.cases:
+            try:
+                procedure_class = case_class(name)
+            except Exception as e:
+                log.exception(f"{name} failed")
+                results.append({"case": name, "error": f"{type(e).__name__}: {e}"})
+                continue
+            pulsed = CASES[name]["parameters"].get("pulse", False)
+            widths = args.pulse_widths if pulsed else [args.pulse_widths[0]]
+            matrix = itertools.product(
+                settings(procedure_class, "emit_decimation", args.decimation),
+                settings(procedure_class, "binary_results", binaries),
+                settings(procedure_class, "fast_reads", fasts),
+                widths,
+            )
+            for decimation, binary, fast, width in matrix:
+                label = (
+                    f"{name} decimation={decimation} binary={binary} "
+                    f"fast_reads={fast} width={width}"
+                )
+                try:
+                    result = run_case(
+                        name,
+                        decimation,
+                        binary,
+                        width,
+                        args.total_time,
+                        directory,
+                        fast,
+                    )
+                except Exception as e:
+                    log.exception(f"{label} failed")
+                    result = {
+                        "case": name,
+                        "emit_decimation": decimation,
+                        "binary_results": binary,
+                        "fast_reads": fast,
+                        "error": f"{type(e).__name__}: {e}",
+                    }
+                print(label, json.dumps(result, default=float))
+                results.append(result)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=1, default=float)
+    print(f"Wrote {len(results)} results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
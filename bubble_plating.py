@@ -1,15 +1,16 @@
-from email.policy import default
 import logging
 import sys
 from time import sleep, perf_counter
-from tracemalloc import start
 import numpy as np
 from pathlib import Path
 from datetime import datetime
-from PyQt5.QtCore import QLocale
-from pymeasure.instruments.keithley import Keithley2400
-from pymeasure.display.Qt import QtGui
+from instruments import open_instrument
 from pymeasure.display.windows import ManagedWindow
+from launcher import launch
+from emit_stage import EmitStage, PipelineParameters
+from loop_timing import LoopTimer
+from fast_read import FAST_READERS
+from keithley2400_buffered import Staircase2400
 
 from pymeasure.experiment import (
     Procedure,
@@ -17,6 +18,7 @@ from pymeasure.experiment import (
     unique_filename,
     Results,
     BooleanParameter,
+    ListParameter,
     Parameter,
 )
 
@@ -24,7 +26,12 @@ log = logging.getLogger("")
 log.addHandler(logging.NullHandler())
 
 
-class BubblePlating(Procedure):
+# Full Rate: as fast as the plating steps, Low Rate: every rest_interval,
+# None: the down time is a pure wait
+REST_SAMPLING = ["Full Rate", "Low Rate", "None"]
+
+
+class BubblePlating(PipelineParameters, Procedure):
     measure_voltage = BooleanParameter("Measure Output Voltage", default=False)
     open_circuit = BooleanParameter("Open Circuit during Pause?", default=False)
 
@@ -36,13 +43,31 @@ class BubblePlating(Procedure):
 
     plating_time = FloatParameter("Plating Time per Voltage", units="s", default=10)
     down_time = FloatParameter("Down Time", units="s", default=10)
+    rest_sampling = ListParameter(
+        "Sampling during Down Time", REST_SAMPLING, default="Low Rate"
+    )
+    rest_interval = FloatParameter(
+        "Down Time Sample Interval",
+        units="s",
+        default=1,
+        group_by="rest_sampling",
+        group_condition="Low Rate",
+    )
+    instrument_timed = BooleanParameter("Instrument Timed Staircase", default=False)
+    sample_interval = FloatParameter(
+        "Sample Interval", units="ms", default=1, group_by="instrument_timed"
+    )
+    data_filename = None
+    # VISA address, None for the fixed default GPIB0::24::INSTR
+    address = None
+    reader = None
 
     DATA_COLUMNS = ["Time (s)", "Current (A)", "Voltage (V)"]
 
     def startup(self):
         log.info("Setting up instruments")
         self.time_offset = 0
-        self.meter = Keithley2400("GPIB0::24::INSTR")
+        self.meter = open_instrument("Keithley2400", self.address or "GPIB0::24::INSTR")
         self.meter.reset()
         self.meter.use_rear_terminals()
         if self.open_circuit:
@@ -80,91 +105,143 @@ class BubblePlating(Procedure):
         self.meter.voltage_nplc = 0.01
         sleep(2)
 
+    def read_sample(self, level):
+        """One reading, current in A; level is reported without voltage measurement."""
+        if self.reader is not None:
+            mcurrent, mvolt = self.reader.read()
+        else:
+            mcurrent, mvolt = self.meter.current, None
+        if mvolt is None:
+            mvolt = level
+        return mcurrent, mvolt
+
+    def plating_voltages(self):
+        voltages = np.arange(
+            self.start_voltage, self.end_voltage + self.step_size, self.step_size
+        )
+        return [round(volt, 2) for volt in voltages]
+
+    def rest_phase_interval(self):
+        """Seconds between readings in the down time, 0 full rate, None none."""
+        if self.rest_sampling == "None":
+            return None
+        if self.rest_sampling == "Low Rate":
+            return self.rest_interval
+        return self.sample_interval / 1000 if self.instrument_timed else 0
+
+    def staircase_segments(self):
+        """(level, duration, interval) of every hold and rest of the staircase."""
+        interval = self.sample_interval / 1000
+        rest_level = None if self.open_circuit else 0
+        rest_interval = self.rest_phase_interval()
+        segments = []
+        for volt in self.plating_voltages():
+            segments.append((volt, self.plating_time, interval))
+            segments.append((rest_level, self.down_time, rest_interval))
+        return segments[:-1]
+
+    def run_phase(self, level, duration, interval, start_time, total_time):
+        """Holds the current output state for duration seconds.
+
+        Reads every interval seconds, as fast as possible for 0 and not at all
+        for None. Returns False when the procedure was stopped.
+        """
+        phase_start = perf_counter()
+        next_read = phase_start
+        while True:
+            now = perf_counter()
+            if now - phase_start >= duration:
+                return True
+            if self.should_stop():
+                log.warning("Catch stop command in procedure")
+                return False
+            if interval is None or now < next_read:
+                wake = phase_start + duration
+                if interval is not None:
+                    wake = min(wake, next_read)
+                sleep(min(max(wake - now, 0), 0.1))
+                continue
+            messt1 = perf_counter()
+            mcurrent, mvolt = self.read_sample(level)
+            messt2 = perf_counter()
+            self.timer.iteration(messt1, messt2)
+            cur_time = (messt1 + messt2) / 2 - start_time
+            self.emitter.push(cur_time + self.time_offset, mcurrent, mvolt)
+            self.emitter.progress(100 * cur_time / total_time)
+            next_read = max(next_read + interval, messt2)
+
+    def execute_staircase(self, total_time):
+        """Whole staircase paced by the trigger model, the host pulls blocks."""
+        staircase = Staircase2400(self.meter, self.meter.current_nplc)
+        staircase.configure()
+        segments = self.staircase_segments()
+        held = None
+        for k, times, currents, volts in staircase.run(segments, self.should_stop):
+            self.emitter.push_block(times + self.time_offset, currents, volts)
+            self.emitter.progress(100 * times[-1] / total_time)
+            if k != held and segments[k][0] is not None:
+                held = k
+                log.info(f"{segments[k][0]} buffered")
+        if self.should_stop():
+            log.warning("Catch stop command in procedure")
+        staircase.set_level(None)
+
     def execute(self):
         log.info("Starting Bubble Plating")
-        # current_list = list()
-        # current_time = list()
-        # voltage_list = list()
-        plating_voltages = np.arange(
-            self.start_voltage, self.end_voltage + self.step_size, self.step_size
+        self.timer = LoopTimer(enabled=self.timing_report)
+        self.emitter = EmitStage(
+            self,
+            decimation=self.emit_decimation,
+            results_file=self.data_filename,
+            binary=self.binary_results,
+            timer=self.timer,
         )
+        plating_voltages = self.plating_voltages()
         total_time = (self.plating_time + self.down_time) * len(
             plating_voltages
         ) - self.down_time
+        if self.instrument_timed:
+            self.execute_staircase(total_time)
+            self.emitter.close()
+            self.timer.save(self.data_filename)
+            return
+        if self.fast_reads or self.measure_voltage:
+            self.reader = FAST_READERS["Keithley2400"](
+                self.meter, self.measure_voltage, binary=self.fast_reads
+            )
+            self.reader.configure()
+        # current_list = list()
+        # current_time = list()
+        # voltage_list = list()
         start_time = perf_counter()
-        for volt in plating_voltages:
-            volt = round(volt, 2)
+        rest_interval = self.rest_phase_interval()
+        for n, volt in enumerate(plating_voltages):
             self.meter.source_voltage = volt
             self.meter.enable_source()
-            cur_volt_time = perf_counter()
-            cur_volt_start_diff = cur_volt_time - start_time
-            while True:
-                cur_time = perf_counter() - cur_volt_time
-                messt1 = perf_counter()
-                if self.measure_voltage:
-                    mvolt, mcurrent = self.meter.current
-                else:
-                    mcurrent = self.meter.current
-                    mvolt = self.voltage
-                messt2 = perf_counter()
-                cur_time = perf_counter() - cur_volt_time - (messt2 - messt1) / 2
-                # current_time.append(cur_time)
-                # voltage_list.append(mvolt)
-                # current_list.append(mcurrent)
-                data = {
-                    "Time (s)": cur_time + cur_volt_start_diff,
-                    "Current (A)": mcurrent,
-                    "Voltage (V)": mvolt,
-                    # "Charge (mAs)": charge,
-                }
-                self.emit("results", data)
-                self.emit("progress", 100 * cur_time / total_time)
-                if self.should_stop():
-                    log.warning("Catch stop command in procedure")
-                    break
-                if cur_time >= self.plating_time:
-                    # print(len(current_list))
-                    break
-
-            pause_start = perf_counter()
+            if not self.run_phase(volt, self.plating_time, 0, start_time, total_time):
+                break
+            if n == len(plating_voltages) - 1:
+                log.info(f"{volt} done")
+                break
             if self.open_circuit:
                 self.meter.disable_source()
-                while perf_counter() - pause_start < self.down_time:
-                    sleep(1)
-                    cur_volt_time = perf_counter()
-                    cur_volt_start_diff = cur_volt_time - start_time
-                    while True:
-                        cur_time = perf_counter() - cur_volt_time
-                        messt1 = perf_counter()
-                        if self.measure_voltage:
-                            mvolt, mcurrent = self.meter.current
-                        else:
-                            mcurrent = self.meter.current
-                            mvolt = self.voltage
-                        messt2 = perf_counter()
-                        cur_time = (
-                            perf_counter() - cur_volt_time - (messt2 - messt1) / 2
-                        )
-                        data = {
-                            "Time (s)": cur_time + cur_volt_start_diff,
-                            "Current (A)": mcurrent,
-                            "Voltage (V)": mvolt,
-                        }
-                        self.emit("results", data)
-                        self.emit("progress", 100 * cur_time / total_time)
-                        if self.should_stop():
-                            log.warning("Catch stop command in procedure")
-                            break
-                        if cur_time >= self.down_time:
-                            # print(len(current_list))
-                            break
+                # The output is off, there is no source level
+                rest_level = float("nan")
             else:
                 self.meter.source_voltage = 0
-
+                rest_level = 0
+            if not self.run_phase(
+                rest_level, self.down_time, rest_interval, start_time, total_time
+            ):
+                break
             log.info(f"{volt} done")
+        if self.reader is not None:
+            self.reader.restore()
+            self.reader = None
+        self.emitter.close()
+        self.timer.save(self.data_filename)
 
     def shutdown(self):
-        self.measure_open_voltage()
         self.meter.write(":DISP:ENAB ON")
         self.meter.shutdown()
         log.info("Finished")
@@ -183,6 +260,14 @@ class MainWindow(ManagedWindow):
                 "step_size",
                 "plating_time",
                 "down_time",
+                "rest_sampling",
+                "rest_interval",
+                "emit_decimation",
+                "binary_results",
+                "timing_report",
+                "fast_reads",
+                "instrument_timed",
+                "sample_interval",
             ],
             displays=[
                 "measure_voltage",
@@ -193,6 +278,14 @@ class MainWindow(ManagedWindow):
                 "step_size",
                 "plating_time",
                 "down_time",
+                "rest_sampling",
+                "rest_interval",
+                "emit_decimation",
+                "binary_results",
+                "timing_report",
+                "fast_reads",
+                "instrument_timed",
+                "sample_interval",
             ],
             x_axis="Time (s)",
             y_axis="Current (A)",
@@ -220,6 +313,7 @@ class MainWindow(ManagedWindow):
         directory = dic_path
         filename = unique_filename(directory, prefix="BP")
         procedure = self.make_procedure()
+        procedure.data_filename = filename
         results = Results(procedure, filename)
         experiment = self.new_experiment(results)
 
@@ -227,8 +321,5 @@ class MainWindow(ManagedWindow):
 
 
 if __name__ == "__main__":
-    app = QtGui.QApplication(sys.argv)
-    QLocale.setDefault(QLocale(QLocale.English, QLocale.UnitedStates))
-    window = MainWindow()
-    window.show()
+    app, window = launch(MainWindow)
     sys.exit(app.exec_())
@@ -0,0 +1,363 @@
+"""
+Runs several plating cells at the same time from one process.
+
+A cell is one procedure of one of the plating scripts on its own source meter,
+in its own pymeasure Worker thread with its own results file. The cells are
+described in a JSON file:
+
+    [
+        {"name": "A", "script": "electroplating2600", "parameters": {"pulse": false}},
+        {"name": "B", "script": "electroplating", "address": "GPIB0::24::INSTR"},
+        {"name": "C", "script": "electroplating2470"}
+    ]
+
+Cells without an address get one instrument of their model from the VISA
+registry, each a different one; a bus scan for that runs in a background
+thread. The dashboard shows status, progress and the last reading of every
+cell in a table, the currents of all cells in one plot in mA, and has start
+and stop buttons per cell. Log lines carry the thread name, which starts
+with the cell name for everything a cell runs.
+
+    python cell_manager.py cells.json --directory D:/EP_Measurements
+"""
+
+import argparse
+import importlib
+import json
+import logging
+import sys
+import threading
+from collections import deque
+from datetime import datetime
+from functools import partial
+from pathlib import Path
+from queue import Empty
+import pyqtgraph as pg
+from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtWidgets import (
+    QFileDialog,
+    QHBoxLayout,
+    QLineEdit,
+    QMainWindow,
+    QPlainTextEdit,
+    QProgressBar,
+    QPushButton,
+    QSplitter,
+    QTableWidget,
+    QTableWidgetItem,
+    QVBoxLayout,
+    QWidget,
+)
+from pymeasure.experiment import Procedure, Results, unique_filename
+from pymeasure.experiment.workers import Worker
+from instruments import simulation_settings
+from launcher import launch
+
+log = logging.getLogger(__name__)
+
+# Script -> (procedure class, instrument model)
+SCRIPTS = {
+    "electroplating": ("Electroplating", "Keithley2400"),
+    "electroplating2470": ("Electroplating", "Keithley2450"),
+    "electroplating2600": ("Electroplating", "Keithley2600"),
+    "bubble_plating": ("BubblePlating", "Keithley2400"),
+}
+
+
+def load_cells(config_file):
+    with open(config_file, "r", encoding="utf-8") as f:
+        return [Cell(**entry) for entry in json.load(f)]
+
+
+class Cell:
+    def __init__(self, name, script, parameters=None, address=None, max_points=5000):
+        if script not in SCRIPTS:
+            raise ValueError(f"Unknown script {script}, known are {list(SCRIPTS)}")
+        self.name = name
+        self.script = script
+        self.model = SCRIPTS[script][1]
+        self.parameters = parameters or {}
+        self.address = address
+        self.status = "Idle"
+        self.progress = 0.0
+        self.data_filename = None
+        self.worker = None
+        # Results rows emitted by the worker, drained by the dashboard
+        self.pending = deque()
+        self.points = deque(maxlen=max_points)
+
+    @property
+    def procedure_class(self):
+        module = importlib.import_module(self.script)
+        return getattr(module, SCRIPTS[self.script][0])
+
+    @property
+    def running(self):
+        return self.worker is not None and self.worker.is_alive()
+
+    def start(self, directory):
+        """Starts the procedure in a new worker, results go below directory."""
+        if self.running:
+            raise RuntimeError(f"Cell {self.name} is already running")
+        procedure = self.procedure_class(**self.parameters)
+        procedure.address = self.address
+        directory = Path(directory) / self.name
+        directory.mkdir(parents=True, exist_ok=True)
+        self.data_filename = unique_filename(directory, prefix=f"{self.name}_")
+        procedure.data_filename = self.data_filename
+        self.points.clear()
+        self.pending.clear()
+        self.worker = CellWorker(self, Results(procedure, self.data_filename))
+        self.worker.start()
+        log.info(f"Cell {self.name} started, results in {self.data_filename}")
+
+    def stop(self):
+        if self.running:
+            self.worker.stop()
+
+    def poll(self):
+        """Takes over status and progress updates, returns the new rows."""
+        if self.worker is not None:
+            while True:
+                try:
+                    message = self.worker.monitor_queue.get_nowait()
+                except Empty:
+                    break
+                if message is None:
+                    continue
+                topic, record = message
+                if topic == "status":
+                    self.status = Procedure.STATUS_STRINGS.get(record, record)
+                elif topic == "progress":
+                    self.progress = record
+        rows = []
+        while self.pending:
+            rows.append(self.pending.popleft())
+        self.points.extend(rows)
+        return rows
+
+
+class CellWorker(Worker):
+    """Worker that also hands the results rows to its cell."""
+
+    def __init__(self, cell, results):
+        super().__init__(results)
+        self.cell = cell
+        self.name = f"cell {cell.name}"
+
+    def emit(self, topic, record):
+        super().emit(topic, record)
+        if topic == "results":
+            self.cell.pending.append(record)
+
+
+def assign_addresses(cells):
+    """Gives every cell without an address its own instrument of its model."""
+    used = {cell.address for cell in cells if cell.address is not None}
+    if len(used) < len([cell for cell in cells if cell.address is not None]):
+        raise ValueError("Several cells use the same address")
+    if simulation_settings() is not None:
+        return
+    from visa_registry import get_registry
+
+    registry = get_registry()
+    for cell in cells:
+        if cell.address is not None:
+            continue
+        free = [a for a in registry.matches(cell.model) if a not in used]
+        if not free:
+            registry.scan()
+            free = [a for a in registry.matches(cell.model) if a not in used]
+        if not free:
+            raise LookupError(f"No free {cell.model} for cell {cell.name}")
+        cell.address = free[0]
+        used.add(cell.address)
+        log.info(f"Cell {cell.name} uses the {cell.model} at {cell.address}")
+
+
+class LogBuffer(logging.Handler):
+    """Keeps formatted log records for the dashboard, from any thread."""
+
+    def __init__(self, maxlen=1000):
+        super().__init__()
+        self.records = deque(maxlen=maxlen)
+        self.setFormatter(
+            logging.Formatter("%(asctime)s %(threadName)s: %(message)s", "%H:%M:%S")
+        )
+
+    def emit(self, record):
+        self.records.append(self.format(record))
+
+
+DASHBOARD_COLUMNS = [
+    "Cell",
+    "Script",
+    "Address",
+    "Status",
+    "Progress",
+    "Time",
+    "Current",
+]
+
+
+# Factors to mA of the current units in DATA_COLUMNS
+CURRENT_UNITS = {"A": 1000, "mA": 1, "uA": 1e-3}
+
+
+def unit_of(column):
+    """Unit in the brackets of a column name, "Current (mA)" -> "mA"."""
+    return column.split(" ")[-1].strip("()")
+
+
+class CellDashboard(QMainWindow):
+    def __init__(self, cells, directory, refresh_interval=200):
+        super().__init__()
+        self.cells = cells
+        # Address assignment may scan the bus, starts run in this order
+        self.start_lock = threading.Lock()
+        self.setWindowTitle("Plating Cells")
+        self.log_buffer = LogBuffer()
+        logging.getLogger().addHandler(self.log_buffer)
+
+        self.directory = QLineEdit(str(directory))
+        browse = QPushButton("...")
+        browse.clicked.connect(self.browse)
+        start_all = QPushButton("Start All")
+        start_all.clicked.connect(self.start_all)
+        stop_all = QPushButton("Stop All")
+        stop_all.clicked.connect(self.stop_all)
+        top = QHBoxLayout()
+        for widget in (self.directory, browse, start_all, stop_all):
+            top.addWidget(widget)
+
+        self.table = QTableWidget(len(cells), len(DASHBOARD_COLUMNS) + 1)
+        self.table.setHorizontalHeaderLabels(DASHBOARD_COLUMNS + [""])
+        self.progress_bars = []
+        self.buttons = []
+        for row, cell in enumerate(cells):
+            self.set_text(row, "Cell", cell.name)
+            self.set_text(row, "Script", cell.script)
+            bar = QProgressBar()
+            self.table.setCellWidget(row, DASHBOARD_COLUMNS.index("Progress"), bar)
+            self.progress_bars.append(bar)
+            button = QPushButton("Start")
+            button.clicked.connect(partial(self.toggle, row))
+            self.table.setCellWidget(row, len(DASHBOARD_COLUMNS), button)
+            self.buttons.append(button)
+
+        self.plot = pg.PlotWidget()
+        self.plot.showGrid(x=True, y=True)
+        self.plot.setLabel("left", "Current", units="mA")
+        self.plot.setLabel("bottom", "Time", units="s")
+        self.plot.addLegend()
+        self.curves = [
+            self.plot.plot(pen=pg.intColor(k, len(cells)), name=cell.name)
+            for k, cell in enumerate(cells)
+        ]
+        self.log_view = QPlainTextEdit()
+        self.log_view.setReadOnly(True)
+        self.log_view.setMaximumBlockCount(2000)
+
+        splitter = QSplitter(Qt.Vertical)
+        for widget in (self.table, self.plot, self.log_view):
+            splitter.addWidget(widget)
+        layout = QVBoxLayout()
+        layout.addLayout(top)
+        layout.addWidget(splitter)
+        central = QWidget()
+        central.setLayout(layout)
+        self.setCentralWidget(central)
+        self.resize(1000, 800)
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(refresh_interval)
+
+    def browse(self):
+        directory = QFileDialog.getExistingDirectory(
+            self, "Results directory", self.directory.text()
+        )
+        if directory:
+            self.directory.setText(directory)
+
+    def run_directory(self):
+        return Path(self.directory.text()) / datetime.today().strftime("%Y%m%d")
+
+    def start(self, row):
+        """Starts a cell from a background thread, the GUI stays responsive."""
+        threading.Thread(
+            target=self._start,
+            args=(row, self.run_directory()),
+            name=f"start cell {self.cells[row].name}",
+            daemon=True,
+        ).start()
+
+    def _start(self, row, directory):
+        with self.start_lock:
+            try:
+                assign_addresses(self.cells)
+                self.cells[row].start(directory)
+            except Exception:
+                log.exception(f"Could not start cell {self.cells[row].name}")
+
+    def toggle(self, row):
+        if self.cells[row].running:
+            self.cells[row].stop()
+        else:
+            self.start(row)
+
+    def start_all(self):
+        for row, cell in enumerate(self.cells):
+            if not cell.running:
+                self.start(row)
+
+    def stop_all(self):
+        for cell in self.cells:
+            cell.stop()
+
+    def set_text(self, row, column, text):
+        column = DASHBOARD_COLUMNS.index(column)
+        self.table.setItem(row, column, QTableWidgetItem(text))
+
+    def refresh(self):
+        for row, cell in enumerate(self.cells):
+            cell.poll()
+            columns = cell.procedure_class.DATA_COLUMNS
+            self.set_text(row, "Address", cell.address or "")
+            self.set_text(row, "Status", cell.status)
+            self.progress_bars[row].setValue(int(cell.progress))
+            if cell.points:
+                last = cell.points[-1]
+                for column, name in zip(("Time", "Current"), columns[:2]):
+                    self.set_text(row, column, f"{last[name]:.4g} {unit_of(name)}")
+                scale = CURRENT_UNITS[unit_of(columns[1])]
+                self.curves[row].setData(
+                    [p[columns[0]] for p in cell.points],
+                    [scale * p[columns[1]] for p in cell.points],
+                )
+            self.buttons[row].setText("Stop" if cell.running else "Start")
+        while self.log_buffer.records:
+            self.log_view.appendPlainText(self.log_buffer.records.popleft())
+
+    def closeEvent(self, event):
+        self.stop_all()
+        for cell in self.cells:
+            if cell.worker is not None:
+                cell.worker.join(timeout=10)
+        logging.getLogger().removeHandler(self.log_buffer)
+        super().closeEvent(event)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run several plating cells")
+    parser.add_argument("config", type=Path, help="JSON file with the cells")
+    parser.add_argument("--directory", type=Path, default=Path("C:/"))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    cells = load_cells(args.config)
+    app, window = launch(partial(CellDashboard, cells, args.directory))
+    sys.exit(app.exec_())
+
+
+if __name__ == "__main__":
+    main()
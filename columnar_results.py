@@ -0,0 +1,132 @@
+"""
+Binary columnar results files.
+
+A run is stored as a directory with one raw little-endian float64 file per
+data column and a meta.json holding the column names and the procedure
+parameters. Blocks are appended to the column files as they come in, so
+writing costs no text formatting, files are 8 bytes per value and a crashed
+run can still be read up to its last complete block.
+
+Export to CSV on demand with:
+    python columnar_results.py <run.epcols> [more runs ...]
+"""
+
+import json
+import sys
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+
+SUFFIX = ".epcols"
+DTYPE = np.dtype("<f8")
+
+
+def columnar_filename(results_file):
+    """Name of the binary full-rate companion of a results file."""
+    results_file = Path(results_file)
+    return results_file.with_name(results_file.stem + "_full" + SUFFIX)
+
+
+def procedure_metadata(procedure):
+    """Procedure class and parameters in a JSON friendly form."""
+    parameters = {}
+    for name, param in procedure.parameter_objects().items():
+        parameters[name] = {
+            "name": param.name,
+            "value": param.value,
+            "units": getattr(param, "units", None),
+        }
+    return {
+        "procedure": f"{procedure.__module__}.{procedure.__class__.__name__}",
+        "parameters": parameters,
+    }
+
+
+class ColumnarWriter:
+    def __init__(self, path, columns, metadata=None):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.columns = list(columns)
+        self.meta = {
+            "columns": self.columns,
+            "files": [f"{i:02d}.f8" for i in range(len(self.columns))],
+            "dtype": DTYPE.str,
+            "created": datetime.now().isoformat(),
+            "rows": 0,
+        }
+        self.meta.update(metadata or {})
+        self.files = [open(self.path / name, "ab") for name in self.meta["files"]]
+        self._write_meta()
+
+    def _write_meta(self):
+        # Replace in one step, a crash never leaves a half written meta.json
+        temporary = self.path / "meta.json.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f, indent=1, default=str)
+        temporary.replace(self.path / "meta.json")
+
+    def write(self, block):
+        """Appends a (rows, columns) block and flushes it to disk."""
+        block = np.asarray(block, dtype=DTYPE)
+        for k, f in enumerate(self.files):
+            f.write(np.ascontiguousarray(block[:, k]).tobytes())
+        self.flush()
+        self.meta["rows"] += len(block)
+        self._write_meta()
+
+    def flush(self):
+        for f in self.files:
+            f.flush()
+
+    def close(self):
+        for f in self.files:
+            f.close()
+        self._write_meta()
+
+
+def read_meta(path):
+    with open(Path(path) / "meta.json", "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_columns(path, mmap=True):
+    """Returns (meta, {column: array}), truncated to the complete rows."""
+    path = Path(path)
+    meta = read_meta(path)
+    dtype = np.dtype(meta["dtype"])
+    files = [path / name for name in meta["files"]]
+    rows = min(f.stat().st_size for f in files) // dtype.itemsize
+    data = {}
+    for name, f in zip(meta["columns"], files):
+        if mmap and rows:
+            data[name] = np.memmap(f, dtype=dtype, mode="r", shape=(rows,))
+        else:
+            data[name] = np.fromfile(f, dtype=dtype, count=rows)
+    return meta, data
+
+
+def export_csv(path, csv_file=None, chunk_rows=100000):
+    """Writes a run as CSV with a pymeasure style header and returns its name."""
+    path = Path(path)
+    if csv_file is None:
+        csv_file = path.with_suffix(".csv")
+    meta, data = load_columns(path)
+    columns = [data[name] for name in meta["columns"]]
+    rows = len(columns[0]) if columns else 0
+    with open(csv_file, "w", encoding="utf-8", newline="") as f:
+        f.write(f"#Procedure: <{meta.get('procedure', '')}>\n")
+        f.write("#Parameters:\n")
+        for param in meta.get("parameters", {}).values():
+            units = f" {param['units']}" if param["units"] else ""
+            f.write(f"#\t{param['name']}: {param['value']}{units}\n")
+        f.write("#Data:\n")
+        f.write(",".join(meta["columns"]) + "\n")
+        for start in range(0, rows, chunk_rows):
+            block = np.column_stack([c[start : start + chunk_rows] for c in columns])
+            np.savetxt(f, block, delimiter=",", fmt="%.9g")
+    return csv_file
+
+
+if __name__ == "__main__":
+    for run in sys.argv[1:]:
+        print(export_csv(run))
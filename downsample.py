@@ -0,0 +1,143 @@
+"""
+Visually lossless downsampling of long traces for plotting.
+
+minmax_envelope keeps the minimum and maximum of every bucket in time order,
+so narrow pulses survive any reduction. lttb is Largest-Triangle-Three-Buckets,
+which keeps the visual shape with one point per bucket. StreamingEnvelope
+builds the min/max envelope chunk by chunk with bounded memory and can be used
+as a results_csv reducer. All output sizes depend on the number of buckets
+(about the plot width in pixels), not on the length of the run.
+"""
+
+import numpy as np
+
+PLOT_BUCKETS = 2000
+
+
+def _bucket_extrema(y, size):
+    """Global indices of the min and max of every bucket of size samples."""
+    n = len(y)
+    buckets = -(-n // size)
+    padded = np.empty(buckets * size, dtype=y.dtype)
+    padded[:n] = y
+    padded[n:] = y[-1]
+    grouped = padded.reshape(buckets, size)
+    offsets = np.arange(buckets) * size
+    imin = np.minimum(grouped.argmin(axis=1) + offsets, n - 1)
+    imax = np.minimum(grouped.argmax(axis=1) + offsets, n - 1)
+    return imin, imax
+
+
+def _ordered_pairs(imin, imax):
+    """Interleaves min and max indices in time order, dropping duplicates."""
+    picks = np.sort(np.stack([imin, imax], axis=1), axis=1)
+    keep = np.ones(picks.shape, dtype=bool)
+    keep[:, 1] = picks[:, 1] != picks[:, 0]
+    return picks[keep]
+
+
+def minmax_envelope(x, y, buckets=PLOT_BUCKETS):
+    """Returns x, y reduced to the min and max point of every bucket."""
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if len(y) <= 2 * buckets:
+        return x, y
+    imin, imax = _bucket_extrema(y, -(-len(y) // buckets))
+    idx = _ordered_pairs(imin, imax)
+    return x[idx], y[idx]
+
+
+def minmax_decimate(block, factor, y_index):
+    """Row-wise min/max reduction of every complete group of factor rows.
+
+    Used on streamed (rows, columns) blocks; returns (reduced, leftover rows).
+    """
+    groups = len(block) // factor
+    leftover = block[groups * factor :]
+    if groups == 0:
+        return block[:0], leftover
+    imin, imax = _bucket_extrema(block[: groups * factor, y_index], factor)
+    return block[_ordered_pairs(imin, imax)], leftover
+
+
+def lttb(x, y, buckets=PLOT_BUCKETS):
+    """Largest-Triangle-Three-Buckets, first and last point are always kept."""
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if n <= buckets or buckets < 3:
+        return x, y
+    edges = np.linspace(1, n - 1, buckets - 1).astype(int)
+    idx = np.empty(buckets, dtype=int)
+    idx[0] = 0
+    idx[-1] = n - 1
+    # Mean of every bucket, used as the third triangle point
+    counts = np.diff(edges)
+    mean_x = np.add.reduceat(x[: edges[-1]], edges[:-1]) / counts
+    mean_y = np.add.reduceat(y[: edges[-1]], edges[:-1]) / counts
+    mean_x = np.append(mean_x, x[-1])
+    mean_y = np.append(mean_y, y[-1])
+    a = 0
+    for k in range(buckets - 2):
+        lo, hi = edges[k], edges[k + 1]
+        bx = x[lo:hi]
+        by = y[lo:hi]
+        area = np.abs(
+            (x[a] - mean_x[k + 1]) * (by - y[a]) - (x[a] - bx) * (mean_y[k + 1] - y[a])
+        )
+        a = lo + int(area.argmax())
+        idx[k + 1] = a
+    return x[idx], y[idx]
+
+
+def downsample(x, y, buckets=PLOT_BUCKETS, mode="minmax"):
+    if mode == "minmax":
+        return minmax_envelope(x, y, buckets)
+    if mode == "lttb":
+        return lttb(x, y, buckets)
+    if mode == "none":
+        return np.asarray(x), np.asarray(y)
+    raise ValueError(f"Unknown downsampling mode {mode}")
+
+
+class StreamingEnvelope:
+    """Reducer building a min/max envelope of x_column, y_column chunk by chunk.
+
+    Samples are reduced in buckets of `size` samples. Whenever more than
+    2 * buckets buckets are stored, neighbouring pairs are merged and the
+    bucket size doubles, so memory stays bounded for any run length.
+    """
+
+    def __init__(self, x_column, y_column, buckets=PLOT_BUCKETS):
+        self.x_column = x_column
+        self.y_column = y_column
+        self.buckets = buckets
+        self.size = 1
+        # Per bucket: x and y of the minimum, x and y of the maximum
+        self.store = np.empty((0, 4))
+
+    def update(self, chunk):
+        x = np.asarray(chunk[self.x_column], dtype=float)
+        y = np.asarray(chunk[self.y_column], dtype=float)
+        if len(y) == 0:
+            return
+        imin, imax = _bucket_extrema(y, self.size)
+        new = np.column_stack([x[imin], y[imin], x[imax], y[imax]])
+        self.store = np.concatenate([self.store, new])
+        while len(self.store) > 2 * self.buckets:
+            self._merge()
+
+    def _merge(self):
+        pairs = len(self.store) // 2
+        a = self.store[0 : 2 * pairs : 2]
+        b = self.store[1 : 2 * pairs : 2]
+        merged = np.where((b[:, 1] < a[:, 1])[:, None], b, a)
+        merged[:, 2:] = np.where((b[:, 3] > a[:, 3])[:, None], b[:, 2:], a[:, 2:])
+        self.store = np.concatenate([merged, self.store[2 * pairs :]])
+        self.size *= 2
+
+    def result(self):
+        first_min = self.store[:, 0] <= self.store[:, 2]
+        x = np.where(first_min[:, None], self.store[:, [0, 2]], self.store[:, [2, 0]])
+        y = np.where(first_min[:, None], self.store[:, [1, 3]], self.store[:, [3, 1]])
+        return x.ravel(), y.ravel()
@@ -4,10 +4,10 @@ from time import sleep, perf_counter
 import numpy as np
 from pathlib import Path
 from datetime import datetime
-from PyQt5.QtCore import QLocale
-from pymeasure.instruments.hp import HP34401A
-from pymeasure.display.Qt import QtGui
+from instruments import open_instrument
+from loop_timing import LoopTimer
 from pymeasure.display.windows import ManagedWindow
+from launcher import launch
 
 from pymeasure.experiment import (
     Procedure,
@@ -41,13 +41,15 @@ class HP_Measure(Procedure):
     # open_circuit = FloatParameter("Range Maximum", default=3)
 
     total_time = FloatParameter("Total Time", units="s", default=60)
+    timing_report = BooleanParameter("Timing Report", default=False)
+    data_filename = None
 
     DATA_COLUMNS = ["Time (s)", "Measurement"]
 
     def startup(self):
         log.info("Setting up instruments")
         self.time_offset = 0
-        self.mm = HP34401A(hp_adress)
+        self.mm = open_instrument("HP34401A", hp_adress)
         self.mm.reset()
         if self.measure_voltage and self.measure_current:
             raise NotImplementedError("Can't do both at the same time")
@@ -73,20 +75,26 @@ class HP_Measure(Procedure):
         # current_list = list()
         # current_time = list()
         # voltage_list = list()
+        self.timer = LoopTimer(enabled=self.timing_report)
         start_time = perf_counter()
         while True:
+            messt1 = perf_counter()
             data = {
                 "Time (s)": perf_counter() - start_time,
                 "Measurement": self.mm.ask(":READ?").strip()
                 # "Charge (mAs)": charge,
             }
+            messt2 = perf_counter()
+            self.timer.iteration(messt1, messt2)
             self.emit("results", data)
+            self.timer.record("emit", perf_counter() - messt2)
             self.emit("progress", 100 * perf_counter() - start_time / self.total_time)
             if self.should_stop():
                 log.warning("Catch stop command in procedure")
                 break
             if perf_counter() - start_time >= self.total_time:
                 break
+        self.timer.save(self.data_filename)
 
     def shutdown(self):
         self.mm.write(":DISP:ENAB ON")
@@ -102,6 +110,7 @@ class MainWindow(ManagedWindow):
                 "measure_voltage",
                 "measure_current",
                 "total_time",
+                "timing_report",
             ],
             displays=[
                 "measure_voltage",
@@ -133,6 +142,7 @@ class MainWindow(ManagedWindow):
         directory = dic_path
         filename = unique_filename(directory, prefix="HP")
         procedure = self.make_procedure()
+        procedure.data_filename = filename
         results = Results(procedure, filename)
         experiment = self.new_experiment(results)
 
@@ -140,8 +150,5 @@ class MainWindow(ManagedWindow):
 
 
 if __name__ == "__main__":
-    app = QtGui.QApplication(sys.argv)
-    QLocale.setDefault(QLocale(QLocale.English, QLocale.UnitedStates))
-    window = MainWindow()
-    window.show()
+    app, window = launch(MainWindow)
     sys.exit(app.exec_())
@@ -1,14 +1,15 @@
 import logging
 import sys
 from time import sleep, perf_counter
-from tracemalloc import start
 import numpy as np
 from pathlib import Path
 from datetime import datetime
-from PyQt5.QtCore import QLocale
-from pymeasure.instruments.keithley import Keithley2400
-from pymeasure.display.Qt import QtGui
+from instruments import open_instrument
 from pymeasure.display.windows import ManagedWindow
+from launcher import launch
+from emit_stage import PipelineParameters
+from acquisition import PlatingLoops
+from keithley2400_buffered import PulseList2400
 
 from pymeasure.experiment import (
     Procedure,
@@ -23,8 +24,18 @@ log = logging.getLogger("")
 log.addHandler(logging.NullHandler())
 
 
-class Electroplating(Procedure):
+class Electroplating(PlatingLoops, PipelineParameters, Procedure):
     pulse = BooleanParameter("Pulse Mode", default=False)
+    instrument_timed = BooleanParameter(
+        "Instrument Timed Pulses", default=False, group_by="pulse"
+    )
+    sample_interval = FloatParameter(
+        "Sample Interval",
+        units="ms",
+        default=1,
+        group_by="instrument_timed",
+        group_condition=True,
+    )
     measure_voltage = BooleanParameter("Measure Output Voltage", default=False)
     charge_stop = BooleanParameter("Charge Stop Mode", default=False)
     max_charge = FloatParameter(
@@ -52,6 +63,10 @@ class Electroplating(Procedure):
     pause_height = FloatParameter(
         "Pause Height", units="V", default="0.5", group_by="pulse"
     )
+    data_filename = None
+    # VISA address, None for the fixed default GPIB0::24::INSTR
+    address = None
+    READER = "Keithley2400"
 
     DATA_COLUMNS = ["Time (s)", "Current (mA)", "Voltage (V)", "Charge (mAs)"]
 
@@ -94,7 +109,7 @@ class Electroplating(Procedure):
     def startup(self):
         log.info("Setting up instruments")
         self.time_offset = 0
-        self.meter = Keithley2400("GPIB0::24::INSTR")
+        self.meter = open_instrument("Keithley2400", self.address or "GPIB0::24::INSTR")
         self.measure_open_voltage()
         self.meter.reset()
         self.meter.use_rear_terminals()
@@ -136,124 +151,54 @@ class Electroplating(Procedure):
 
         sleep(2)
 
-    def execute(self):
-        if self.pulse:
-            current_list = list()
-            current_time = list()
-            voltage_list = list()
-            charge_1 = 0
-            mcurrent_1 = 0
-            mtime_1 = 0
-            self.pulse_width /= 1000
-            self.pause_width /= 1000
-            PULSE = False
-            log.info("Starting pulsed electroplating")
+    def meter_current(self):
+        return self.meter.current
 
-            self.meter.source_voltage = self.pause_height
-            self.meter.enable_source()
-            start_time = perf_counter()
-            cur_pulse_time = perf_counter()
-            while True:
-                cur_time = perf_counter() - start_time
-                if PULSE:
-                    if perf_counter() >= cur_pulse_time + self.pulse_width:
-                        messt1 = perf_counter()
-                        self.meter.source_voltage = self.pause_height
-                        messt2 = perf_counter()
-                        cur_pulse_time = perf_counter() - (messt2 - messt1) / 2
-                        PULSE = False
-                else:
-                    if perf_counter() >= cur_pulse_time + self.pause_width:
-                        messt1 = perf_counter()
-                        self.meter.source_voltage = self.pulse_height
-                        messt2 = perf_counter()
-                        cur_pulse_time = perf_counter() - (messt2 - messt1) / 2
-                        PULSE = True
-                messt1 = perf_counter()
-                if self.measure_voltage:
-                    mvolt, mcurrent = self.meter.current
-                else:
-                    mcurrent = self.meter.current
-                    mvolt = self.voltage
-                mcurrent *= 1000
-                messt2 = perf_counter()
-                cur_time = perf_counter() - start_time - (messt2 - messt1) / 2
-                current_time.append(cur_time)
-                voltage_list.append(mvolt)
-                current_list.append(mcurrent)
-                charge = charge_1 + np.trapz(
-                    [mcurrent_1, mcurrent], [mtime_1, cur_time]
-                )
-                charge_1 = charge
-                mcurrent_1 = mcurrent
-                mtime_1 = cur_time
-                data = {
-                    "Time (s)": cur_time + self.time_offset,
-                    "Current (mA)": mcurrent,
-                    "Voltage (V)": mvolt,
-                    "Charge (mAs)": charge,
-                }
-                self.emit("results", data)
-                self.emit("progress", 100 * cur_time / self.total_time)
-                if self.should_stop():
-                    log.warning("Catch stop command in procedure")
-                    break
-                if self.charge_stop and charge >= self.max_charge:
-                    log.info("Maximum Charge reached")
-                    break
-                if cur_time >= self.total_time:
-                    print(len(current_list))
-                    break
-        else:
-            current_list = list()
-            current_time = list()
-            voltage_list = list()
-            charge_1 = 0
-            mcurrent_1 = 0
-            mtime_1 = 0
-            log.info("Starting constant electroplating")
+    def meter_set_voltage(self, voltage):
+        self.meter.source_voltage = voltage
+
+    def meter_output_on(self):
+        self.meter.enable_source()
 
-            self.meter.source_voltage = self.voltage
-            self.meter.enable_source()
-            start_time = perf_counter()
-            while True:
-                messt1 = perf_counter()
-                if self.measure_voltage:
-                    mvolt, mcurrent = self.meter.current
+    def execute_list_pulse(self):
+        """Pulse train run as a source list sweep, read back from the trace buffer."""
+        log.info("Starting instrument timed pulsed electroplating")
+        pulses = PulseList2400(self.meter)
+        pulses.configure(
+            self.pulse_height,
+            self.pulse_width / 1000,
+            self.pause_height,
+            self.pause_width / 1000,
+            self.sample_interval / 1000,
+            self.meter.current_nplc,
+        )
+        self.meter.enable_source()
+        try:
+            return self.consume(self.list_pulse_blocks(pulses))
+        finally:
+            pulses.abort()
 
-                else:
-                    mcurrent = self.meter.current
-                    mvolt = self.voltage
-                mcurrent *= 1000
-                messt2 = perf_counter()
-                cur_time = perf_counter() - start_time - (messt2 - messt1) / 2
-                current_time.append(cur_time)
-                current_list.append(mcurrent)
-                voltage_list.append(mvolt)
-                charge = charge_1 + np.trapz(
-                    [mcurrent_1, mcurrent], [mtime_1, cur_time]
-                )
-                charge_1 = charge
-                mcurrent_1 = mcurrent
-                mtime_1 = cur_time
-                data = {
-                    "Time (s)": cur_time + self.time_offset,
-                    "Current (mA)": mcurrent,
-                    "Voltage (V)": mvolt,
-                    "Charge (mAs)": charge,
-                }
-                self.emit("results", data)
-                self.emit("progress", 100 * cur_time / self.total_time)
-                if self.should_stop():
-                    log.warning("Catch stop command in procedure")
-                    break
-                if self.charge_stop and charge >= self.max_charge:
-                    log.info("Maximum Charge reached")
-                    break
-                if cur_time >= self.total_time:
-                    print(len(current_list))
-                    break
-        self.time_offset = self.time_offset + cur_time
+    def list_pulse_blocks(self, pulses):
+        """Blocks of the pulse list until total_time, for consume()."""
+        while True:
+            pulses.start_block()
+            if not pulses.wait_block(self.should_stop):
+                log.warning("Catch stop command in procedure")
+                return
+            messt1 = perf_counter()
+            times, currents, volts = pulses.read_block()
+            self.timer.iteration(messt1, perf_counter())
+            yield times, currents * 1000, volts, self.pulse_phases(volts)
+            if len(times) and times[-1] >= self.total_time:
+                return
+
+    def execute(self):
+        self.start_pipeline()
+        if self.pulse and self.instrument_timed:
+            cur_time = self.execute_list_pulse()
+        else:
+            cur_time = self.execute_host_timed()
+        self.finish_pipeline(cur_time)
 
     def shutdown(self):
         self.measure_open_voltage()
@@ -271,8 +216,14 @@ class MainWindow(ManagedWindow):
                 "charge_stop",
                 "max_charge",
                 "pulse",
+                "instrument_timed",
+                "sample_interval",
                 "max_current",
                 "total_time",
+                "emit_decimation",
+                "binary_results",
+                "timing_report",
+                "fast_reads",
                 "pulse_width",
                 "pulse_height",
                 "pause_width",
@@ -284,6 +235,8 @@ class MainWindow(ManagedWindow):
                 "charge_stop",
                 "max_charge",
                 "pulse",
+                "instrument_timed",
+                "sample_interval",
                 "max_current",
                 "total_time",
                 "pulse_width",
@@ -318,6 +271,7 @@ class MainWindow(ManagedWindow):
         directory = dic_path
         filename = unique_filename(directory, prefix="EP")
         procedure = self.make_procedure()
+        procedure.data_filename = filename
         results = Results(procedure, filename)
         experiment = self.new_experiment(results)
 
@@ -325,8 +279,5 @@ class MainWindow(ManagedWindow):
 
 
 if __name__ == "__main__":
-    app = QtGui.QApplication(sys.argv)
-    QLocale.setDefault(QLocale(QLocale.English, QLocale.UnitedStates))
-    window = MainWindow()
-    window.show()
+    app, window = launch(MainWindow)
     sys.exit(app.exec_())
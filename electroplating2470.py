@@ -1,16 +1,14 @@
 import logging
 import sys
 from time import sleep, perf_counter
-from tracemalloc import start
 import numpy as np
 from pathlib import Path
 from datetime import datetime
-from PyQt5.QtCore import QLocale
-from pymeasure.instruments.keithley import Keithley2400, Keithley2450
-from pymeasure.display.Qt import QtGui
+from instruments import open_instrument
 from pymeasure.display.windows import ManagedWindow
-import pyvisa
-rm = pyvisa.ResourceManager()
+from launcher import launch
+from emit_stage import PipelineParameters
+from acquisition import PlatingLoops
 from pymeasure.experiment import (
     Procedure,
     FloatParameter,
@@ -23,8 +21,11 @@ from pymeasure.experiment import (
 log = logging.getLogger("")
 log.addHandler(logging.NullHandler())
 
+# The instrument is looked up by its identity, see launcher.py
+PREFETCH_VISA = True
 
-class Electroplating(Procedure):
+
+class Electroplating(PlatingLoops, PipelineParameters, Procedure):
     pulse = BooleanParameter("Pulse Mode", default=False)
     measure_voltage = BooleanParameter("Measure Output Voltage", default=False)
     charge_stop = BooleanParameter("Charge Stop Mode", default=False)
@@ -53,6 +54,10 @@ class Electroplating(Procedure):
     pause_height = FloatParameter(
         "Pause Height", units="V", default="0.5", group_by="pulse"
     )
+    data_filename = None
+    # VISA address, None to look the instrument up by its identity
+    address = None
+    READER = "Keithley2450"
 
     DATA_COLUMNS = ["Time (s)", "Current (mA)", "Voltage (V)", "Charge (mAs)"]
 
@@ -97,7 +102,7 @@ class Electroplating(Procedure):
         log.info("Setting up instruments")
         self.time_offset = 0
         # self.meter = Keithley2400("GPIB0::24::INSTR")
-        self.meter = Keithley2450(rm.list_resources()[0])
+        self.meter = open_instrument("Keithley2450", self.address)
         # self.measure_open_voltage()
         self.meter.reset()
         self.meter.use_front_terminals()
@@ -125,6 +130,8 @@ class Electroplating(Procedure):
                 # ":SENS:AZER:STAT OFF",
                 # ":SENS:FUNC:OFF:ALL",
                 ":SENS:FUNC 'CURR'",
+                # Source value of a reading is the measured output voltage
+                ":SOUR:VOLT:READ:BACK ON",
                 # ":FORM:ELEM VOLT,CURR",
                 # ":SENSE:AVER:STAT OFF",
                 # ":SYSTEM:TIME:RESET:AUTO ON",
@@ -143,124 +150,19 @@ class Electroplating(Procedure):
 
         sleep(2)
 
-    def execute(self):
-        if self.pulse:
-            current_list = list()
-            current_time = list()
-            voltage_list = list()
-            charge_1 = 0
-            mcurrent_1 = 0
-            mtime_1 = 0
-            self.pulse_width /= 1000
-            self.pause_width /= 1000
-            PULSE = False
-            log.info("Starting pulsed electroplating")
+    def meter_current(self):
+        return self.meter.current
 
-            self.meter.source_voltage = self.pause_height
-            self.meter.enable_source()
-            start_time = perf_counter()
-            cur_pulse_time = perf_counter()
-            while True:
-                cur_time = perf_counter() - start_time
-                if PULSE:
-                    if perf_counter() >= cur_pulse_time + self.pulse_width:
-                        messt1 = perf_counter()
-                        self.meter.source_voltage = self.pause_height
-                        messt2 = perf_counter()
-                        cur_pulse_time = perf_counter() - (messt2 - messt1) / 2
-                        PULSE = False
-                else:
-                    if perf_counter() >= cur_pulse_time + self.pause_width:
-                        messt1 = perf_counter()
-                        self.meter.source_voltage = self.pulse_height
-                        messt2 = perf_counter()
-                        cur_pulse_time = perf_counter() - (messt2 - messt1) / 2
-                        PULSE = True
-                messt1 = perf_counter()
-                if self.measure_voltage:
-                    mvolt, mcurrent = self.meter.current
-                else:
-                    mcurrent = self.meter.current
-                    mvolt = self.voltage
-                mcurrent *= 1000
-                messt2 = perf_counter()
-                cur_time = perf_counter() - start_time - (messt2 - messt1) / 2
-                current_time.append(cur_time)
-                voltage_list.append(mvolt)
-                current_list.append(mcurrent)
-                charge = charge_1 + np.trapz(
-                    [mcurrent_1, mcurrent], [mtime_1, cur_time]
-                )
-                charge_1 = charge
-                mcurrent_1 = mcurrent
-                mtime_1 = cur_time
-                data = {
-                    "Time (s)": cur_time + self.time_offset,
-                    "Current (mA)": mcurrent,
-                    "Voltage (V)": mvolt,
-                    "Charge (mAs)": charge,
-                }
-                self.emit("results", data)
-                self.emit("progress", 100 * cur_time / self.total_time)
-                if self.should_stop():
-                    log.warning("Catch stop command in procedure")
-                    break
-                if self.charge_stop and charge >= self.max_charge:
-                    log.info("Maximum Charge reached")
-                    break
-                if cur_time >= self.total_time:
-                    print(len(current_list))
-                    break
-        else:
-            current_list = list()
-            current_time = list()
-            voltage_list = list()
-            charge_1 = 0
-            mcurrent_1 = 0
-            mtime_1 = 0
-            log.info("Starting constant electroplating")
+    def meter_set_voltage(self, voltage):
+        self.meter.source_voltage = voltage
 
-            self.meter.source_voltage = self.voltage
-            self.meter.enable_source()
-            start_time = perf_counter()
-            while True:
-                messt1 = perf_counter()
-                if self.measure_voltage:
-                    mvolt, mcurrent = self.meter.current
+    def meter_output_on(self):
+        self.meter.enable_source()
 
-                else:
-                    mcurrent = self.meter.current
-                    mvolt = self.voltage
-                mcurrent *= 1000
-                messt2 = perf_counter()
-                cur_time = perf_counter() - start_time - (messt2 - messt1) / 2
-                current_time.append(cur_time)
-                current_list.append(mcurrent)
-                voltage_list.append(mvolt)
-                charge = charge_1 + np.trapz(
-                    [mcurrent_1, mcurrent], [mtime_1, cur_time]
-                )
-                charge_1 = charge
-                mcurrent_1 = mcurrent
-                mtime_1 = cur_time
-                data = {
-                    "Time (s)": cur_time + self.time_offset,
-                    "Current (mA)": mcurrent,
-                    "Voltage (V)": mvolt,
-                    "Charge (mAs)": charge,
-                }
-                self.emit("results", data)
-                self.emit("progress", 100 * cur_time / self.total_time)
-                if self.should_stop():
-                    log.warning("Catch stop command in procedure")
-                    break
-                if self.charge_stop and charge >= self.max_charge:
-                    log.info("Maximum Charge reached")
-                    break
-                if cur_time >= self.total_time:
-                    print(len(current_list))
-                    break
-        self.time_offset = self.time_offset + cur_time
+    def execute(self):
+        self.start_pipeline()
+        cur_time = self.execute_host_timed()
+        self.finish_pipeline(cur_time)
 
     def shutdown(self):
         # self.measure_open_voltage()
@@ -280,6 +182,10 @@ class MainWindow(ManagedWindow):
                 "pulse",
                 "max_current",
                 "total_time",
+                "emit_decimation",
+                "binary_results",
+                "timing_report",
+                "fast_reads",
                 "pulse_width",
                 "pulse_height",
                 "pause_width",
@@ -325,6 +231,7 @@ class MainWindow(ManagedWindow):
         directory = dic_path
         filename = unique_filename(directory, prefix="EP")
         procedure = self.make_procedure()
+        procedure.data_filename = filename
         results = Results(procedure, filename)
         experiment = self.new_experiment(results)
 
@@ -332,8 +239,5 @@ class MainWindow(ManagedWindow):
 
 
 if __name__ == "__main__":
-    app = QtGui.QApplication(sys.argv)
-    QLocale.setDefault(QLocale(QLocale.English, QLocale.UnitedStates))
-    window = MainWindow()
-    window.show()
+    app, window = launch(MainWindow, prefetch_visa=PREFETCH_VISA)
     sys.exit(app.exec_())
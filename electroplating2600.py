@@ -1,21 +1,24 @@
 import logging
-import shutil
 import sys
 import subprocess
 from time import sleep, perf_counter
-from tracemalloc import start
 import numpy as np
 from pathlib import Path
 from datetime import datetime
-from PyQt5.QtCore import QLocale
-from pymeasure.instruments.keithley import Keithley2600
+from instruments import open_instrument
 
-from pymeasure.display.Qt import QtWidgets
 from pymeasure.display.windows import ManagedWindow
-import pyvisa
+from launcher import launch
+from emit_stage import EmitStage, PipelineParameters, ResultsWriter
+from pulse_scheduler import PulseScheduler
+from acquisition import DualAcquisition, PlatingLoops
+from fast_read import DualReader2600
+from charge_integrator import ChargeIntegrator
 from constants import ele_dict, membrane_dict
+from keithley2600_buffered import PulseTrain2600
+from telegram_sender import get_notifier
+from results_mirror import ResultsMirror
 
-rm = pyvisa.ResourceManager()
 from pymeasure.experiment import (
     Procedure,
     FloatParameter,
@@ -28,10 +31,24 @@ from pymeasure.experiment import (
 
 FARADAY = 96485.332123
 
+# ChA parameter -> ChB parameter of a dual channel run
+CHANNEL_B_PARAMETERS = {
+    "voltage": "voltage_b",
+    "pulse_width": "pulse_width_b",
+    "pulse_height": "pulse_height_b",
+    "pause_width": "pause_width_b",
+    "pause_height": "pause_height_b",
+    "max_charge": "max_charge_b",
+    "sample_notes": "sample_notes_b",
+}
+
 
 log = logging.getLogger("")
 log.addHandler(logging.NullHandler())
 
+# The instrument is looked up by its identity, see launcher.py
+PREFETCH_VISA = True
+
 
 def calc_fill_factor(nw_dia, nw_dens):
     wire_area = nw_dia * nw_dia * (np.pi / 4) * 1e-9 * 1e-9
@@ -39,6 +56,12 @@ def calc_fill_factor(nw_dia, nw_dens):
     return fillfactor
 
 
+def channel_b_filename(filename):
+    """Name of the ChB results file of a dual channel run."""
+    filename = Path(filename)
+    return filename.with_name(filename.stem + "_ChB.csv")
+
+
 def calc_charge_plating(
     nw_dia, nw_dens, nw_height, photo_height, growth_area, material="Cu Ele V1"
 ):
@@ -60,7 +83,7 @@ def calc_charge_plating(
     return max_charge
 
 
-class Electroplating(Procedure):
+class Electroplating(PlatingLoops, PipelineParameters, Procedure):
     material_sel = ListParameter(
         "Material Selection",
         [k for k in ele_dict.keys()],
@@ -72,7 +95,10 @@ class Electroplating(Procedure):
         default=list(membrane_dict.keys())[0],
     )
     pulse = BooleanParameter("Pulse Mode", default=True)
-    # measure_voltage = BooleanParameter("Measure Output Voltage", default=False)
+    instrument_timed = BooleanParameter(
+        "Instrument Timed Pulses", default=False, group_by="pulse"
+    )
+    measure_voltage = BooleanParameter("Measure Output Voltage", default=False)
     charge_stop = BooleanParameter(
         "Charge Stop Mode",
         default=False,
@@ -159,6 +185,31 @@ class Electroplating(Procedure):
         "Pause Height", units="V", default=0.05, group_by="pulse"
     )
     sample_notes = Parameter("Sample Notes", default="")
+    dual_channel = BooleanParameter("Plate on ChA and ChB", default=False)
+    voltage_b = FloatParameter(
+        "ChB Applied Voltage", units="V", default=0.5, group_by="dual_channel"
+    )
+    pulse_width_b = FloatParameter(
+        "ChB Pulse Width", units="ms", default=40, group_by="dual_channel"
+    )
+    pulse_height_b = FloatParameter(
+        "ChB Pulse Height", units="V", default=0.1, group_by="dual_channel"
+    )
+    pause_width_b = FloatParameter(
+        "ChB Pause Width", units="ms", default=40, group_by="dual_channel"
+    )
+    pause_height_b = FloatParameter(
+        "ChB Pause Height", units="V", default=0.05, group_by="dual_channel"
+    )
+    max_charge_b = FloatParameter(
+        "ChB Max Charge", units="mC", default=10000, group_by="dual_channel"
+    )
+    sample_notes_b = Parameter("ChB Sample Notes", default="", group_by="dual_channel")
+    data_filename = None
+    # VISA address, None to look the instrument up by its identity
+    address = None
+    READER = "Keithley2600"
+    mirror = None
 
     DATA_COLUMNS = ["Time (s)", "Current (mA)", "Voltage (V)", "Charge (mC)"]
 
@@ -200,7 +251,6 @@ class Electroplating(Procedure):
         self.meter.disable_source()
 
     def startup(self):
-        self.measure_voltage = False
         log.info("Setting up instruments")
         if self.nw_charge_stop:
             current_membrane = membrane_dict[self.membrane_sel]
@@ -228,9 +278,11 @@ class Electroplating(Procedure):
             log.info(f"{self.max_charge=}")
             # print(f"{self.max_charge=}")
         self.time_offset = 0
+        self.notifier = get_notifier()
+        self.start_mirror()
         # raise NotImplementedError
         # self.meter = Keithley2400("GPIB0::24::INSTR")
-        self.meter = Keithley2600(rm.list_resources()[0])
+        self.meter = open_instrument("Keithley2600", self.address)
         # self.measure_open_voltage()
         # self.meter.reset()
         # self.meter.use_front_terminals()
@@ -275,164 +327,255 @@ class Electroplating(Procedure):
         self.meter.ChA.write("measure.autozero = smua.AUTOZERO_ONCE")
         self.meter.ChA.write("measure.delay = 0")
         self.meter.ChA.write("source.delay = 0")
+        if self.dual_channel:
+            self.meter.ChB.compliance_current = self.max_current / 1000
+            self.meter.ChB.write("measure.nplc = 0.001")
+            self.meter.ChB.write("measure.autozero = smub.AUTOZERO_ONCE")
+            self.meter.ChB.write("measure.delay = 0")
+            self.meter.ChB.write("source.delay = 0")
         # self.meter.current_nplc = 0.01
         # self.meter.voltage_nplc = 0.01
 
         sleep(2)
 
-    def execute(self):
+    def meter_current(self):
+        return self.meter.ChA.current
+
+    def meter_set_voltage(self, voltage):
+        self.meter.ChA.source_voltage = voltage
+
+    def meter_output_on(self):
+        self.meter.ChA.source_output = "ON"
+
+    def execute_instrument_pulse(self):
+        """Pulse train generated by a TSP script, drained from nvbuffer1 in chunks."""
+        log.info("Starting instrument timed pulsed electroplating")
+        self.notifier.send("START")
+        train = PulseTrain2600(self.meter, "a", measure_voltage=self.measure_voltage)
+        train.load()
+        train.start(
+            self.pulse_height,
+            self.pulse_width / 1000,
+            self.pause_height,
+            self.pause_width / 1000,
+            self.total_time,
+        )
+        try:
+            return self.consume(self.instrument_pulse_blocks(train))
+        finally:
+            train.abort()
+
+    def instrument_pulse_blocks(self, train):
+        """Chunks of the TSP pulse train until it ends, for consume()."""
+        while True:
+            messt1 = perf_counter()
+            chunk = train.read_chunk()
+            self.timer.iteration(messt1, perf_counter())
+            if chunk is None:
+                return
+            times, currents, volts = chunk
+            yield times, currents * 1000, volts, self.pulse_phases(volts)
+
+    def block_done(self, cur_time):
+        self.notifier.progress(self.done_fraction(cur_time))
+
+    def done_fraction(self, cur_time):
+        """Share of the run done, by charge when there is a charge stop."""
+        if self.charge_stop:
+            return self.integrator.charge / self.max_charge
+        return cur_time / self.total_time
+
+    def channel_b_procedure(self):
+        """A copy of this procedure with the ChB values under the ChA names.
+
+        With the nanowire charge stop both channels get the calculated charge.
+        """
+        values = self.parameter_values()
+        for name, name_b in CHANNEL_B_PARAMETERS.items():
+            if name == "max_charge" and self.nw_charge_stop:
+                continue
+            values[name] = values[name_b]
+        return self.__class__(**values)
+
+    def set_channel_voltage(self, channel, voltage):
+        """Sources voltage on ChA (0) or ChB (1); None turns the channel off."""
+        smu = (self.meter.ChA, self.meter.ChB)[channel]
+        if voltage is None:
+            smu.source_voltage = 0
+            smu.source_output = "OFF"
+            return
+        smu.source_voltage = voltage
+        self.source_levels[channel] = voltage
+
+    def read_pair(self):
+        """One reading of both channels in one transaction, currents in mA."""
+        current_a, voltage_a, current_b, voltage_b = self.reader.read()
+        if voltage_a is None:
+            voltage_a, voltage_b = self.source_levels
+        return 1000 * current_a, voltage_a, 1000 * current_b, voltage_b
+
+    def execute_dual(self):
+        """ChA and ChB plate at once, each with its pulses and charge target.
+
+        Both channels are read in one transaction per sample, so neither
+        sample rate halves. ChB is written to its own results file.
+        """
+        log.info("Starting dual channel electroplating")
+        self.notifier.send("START")
+        channel_b = self.channel_b_procedure()
+        filename_b = channel_b_filename(self.data_filename)
+        writer = ResultsWriter(channel_b, filename_b)
+        channel_b.emit = writer.emit
+        emitter_b = EmitStage(
+            channel_b,
+            decimation=self.emit_decimation,
+            results_file=filename_b,
+            binary=self.binary_results,
+        )
+        integrator_b = ChargeIntegrator(channel_b.max_charge)
+        channels = [
+            (self, self.emitter, self.integrator, self.samples),
+            (channel_b, emitter_b, integrator_b, None),
+        ]
+        schedulers = (None, None)
         if self.pulse:
-            current_list = list()
-            current_time = list()
-            voltage_list = list()
-            charge_1 = 0
-            mcurrent_1 = 0
-            mtime_1 = 0
-            self.pulse_width /= 1000
-            self.pause_width /= 1000
-            PULSE = False
-            log.info("Starting pulsed electroplating")
-            subprocess.Popen(
-                [sys.executable, "telegram_sender.py", "START"],
-                stdout=subprocess.DEVNULL,
+            scheduler_a = PulseScheduler(
+                self.pulse_width / 1000, self.pause_width / 1000
             )
-            self.meter.ChA.source_voltage = self.pause_height
-            # self.meter.ChA.source_voltage = self.voltage
-            self.meter.ChA.source_output = "ON"
-            start_time = perf_counter()
-            cur_pulse_time = perf_counter()
-            while True:
-                cur_time = perf_counter() - start_time
-                if PULSE:
-                    if perf_counter() >= cur_pulse_time + self.pulse_width:
-                        messt1 = perf_counter()
-                        self.meter.ChA.source_voltage = self.pause_height
-                        messt2 = perf_counter()
-                        cur_pulse_time = perf_counter() - (messt2 - messt1) / 2
-                        PULSE = False
-                else:
-                    if perf_counter() >= cur_pulse_time + self.pause_width:
-                        messt1 = perf_counter()
-                        self.meter.ChA.source_voltage = self.pulse_height
-                        messt2 = perf_counter()
-                        cur_pulse_time = perf_counter() - (messt2 - messt1) / 2
-                        PULSE = True
-                messt1 = perf_counter()
-                if self.measure_voltage:
-                    mvolt, mcurrent = self.meter.current
-                else:
-                    mcurrent = self.meter.ChA.current
-                    mvolt = self.voltage
-                mcurrent *= 1000
-                messt2 = perf_counter()
-                cur_time = perf_counter() - start_time - (messt2 - messt1) / 2
-                current_time.append(cur_time)
-                voltage_list.append(mvolt)
-                current_list.append(mcurrent)
-                charge = charge_1 + np.trapz(
-                    [mcurrent_1, mcurrent], [mtime_1, cur_time]
-                )
-                charge_1 = charge
-                mcurrent_1 = mcurrent
-                mtime_1 = cur_time
-                data = {
-                    "Time (s)": cur_time + self.time_offset,
-                    "Current (mA)": mcurrent,
-                    "Voltage (V)": mvolt,
-                    "Charge (mC)": charge,
-                }
-                self.emit("results", data)
-                self.emit("progress", 100 * cur_time / self.total_time)
+            scheduler_b = PulseScheduler(
+                channel_b.pulse_width / 1000,
+                channel_b.pause_width / 1000,
+                start=scheduler_a.start,
+            )
+            schedulers = (scheduler_a, scheduler_b)
+        self.source_levels = [None, None]
+        for k, (procedure, _, _, _) in enumerate(channels):
+            if self.pulse:
+                self.set_channel_voltage(k, procedure.pause_height)
+            else:
+                self.set_channel_voltage(k, procedure.voltage)
+        self.meter.ChA.source_output = "ON"
+        self.meter.ChB.source_output = "ON"
+
+        cur_time = 0
+        done = [False, False]
+        self.reader = DualReader2600(
+            self.meter, self.measure_voltage, binary=self.fast_reads
+        )
+        self.reader.configure()
+        acquisition = DualAcquisition(
+            self.read_pair,
+            self.total_time,
+            schedulers,
+            self.set_channel_voltage,
+            [procedure.pulse_height for procedure, _, _, _ in channels],
+            [procedure.pause_height for procedure, _, _, _ in channels],
+            timer=self.timer,
+        )
+        acquisition.start()
+        try:
+            for times, *columns in acquisition.blocks():
+                for k, (_, emitter, integrator, samples) in enumerate(channels):
+                    if done[k] or not len(times):
+                        continue
+                    currents, volts, in_pulse = columns[3 * k : 3 * k + 3]
+                    if schedulers[k] is None:
+                        in_pulse = None
+                    charges = integrator.add_block(times, currents, in_pulse)
+                    emitter.push_block(
+                        times + self.time_offset, currents, volts, charges
+                    )
+                    if samples is not None:
+                        samples.append_block(times, currents, volts)
+                    if self.charge_stop and integrator.reached:
+                        log.info(f"Maximum Charge reached on Ch{'AB'[k]}")
+                        done[k] = True
+                        acquisition.finish(k)
+                if len(times):
+                    cur_time = times[-1]
+                    self.emitter.progress(100 * cur_time / self.total_time)
+                self.notifier.progress(self.done_fraction(cur_time))
                 if self.should_stop():
                     log.warning("Catch stop command in procedure")
                     break
-                if self.charge_stop and charge >= self.max_charge:
-                    log.info("Maximum Charge reached")
-                    break
-                if cur_time >= self.total_time:
-                    print(len(current_list))
+                if all(done):
                     break
+        finally:
+            acquisition.stop()
+            self.reader.restore()
+            self.reader = None
+            emitter_b.close()
+            writer.close()
+        for scheduler, name in zip(schedulers, "AB"):
+            if scheduler is not None:
+                log.info(f"Ch{name} pulses: {scheduler.summary()}")
+        log.info(f"ChB plating done, {integrator_b.summary()}")
+        return cur_time
+
+    def execute(self):
+        self.start_pipeline()
+        if self.dual_channel:
+            if self.pulse and self.instrument_timed:
+                log.warning("Dual channel pulses are host timed")
+            cur_time = self.execute_dual()
+        elif self.pulse and self.instrument_timed:
+            cur_time = self.execute_instrument_pulse()
         else:
-            current_list = list()
-            current_time = list()
-            voltage_list = list()
-            charge_1 = 0
-            mcurrent_1 = 0
-            mtime_1 = 0
-            log.info("Starting constant electroplating")
-
-            self.meter.ChA.source_voltage = self.voltage
-            self.meter.ChA.source_output = "ON"
-            start_time = perf_counter()
-            while True:
-                messt1 = perf_counter()
-                if self.measure_voltage:
-                    mvolt, mcurrent = self.meter.current
-
-                else:
-                    mcurrent = self.meter.ChA.current
-                    mvolt = self.voltage
-                mcurrent *= 1000
-                messt2 = perf_counter()
-                cur_time = perf_counter() - start_time - (messt2 - messt1) / 2
-                current_time.append(cur_time)
-                current_list.append(mcurrent)
-                voltage_list.append(mvolt)
-                charge = charge_1 + np.trapz(
-                    [mcurrent_1, mcurrent], [mtime_1, cur_time]
-                )
-                charge_1 = charge
-                mcurrent_1 = mcurrent
-                mtime_1 = cur_time
-                data = {
-                    "Time (s)": cur_time + self.time_offset,
-                    "Current (mA)": mcurrent,
-                    "Voltage (V)": mvolt,
-                    "Charge (mC)": charge,
-                }
-                self.emit("results", data)
-                self.emit("progress", 100 * cur_time / self.total_time)
-                if self.should_stop():
-                    log.warning("Catch stop command in procedure")
-                    break
-                if self.charge_stop and charge >= self.max_charge:
-                    log.info("Maximum Charge reached")
-                    break
-                if cur_time >= self.total_time:
-                    print(len(current_list))
-                    break
-        self.time_offset = self.time_offset + cur_time
+            if self.pulse:
+                self.notifier.send("START")
+            cur_time = self.execute_host_timed()
+        self.finish_pipeline(cur_time)
 
     def shutdown(self):
         # self.measure_open_voltage()
         # self.meter.write(":DISP:LIGH:STAT ON50",)
         # self.meter.shutdown()
-        self.meter.ChA.source_voltage = 0
-        self.meter.ChA.source_output = "OFF"
-        subprocess.Popen(
-            [sys.executable, "telegram_sender.py", "FINISHED"],
-            stdout=subprocess.DEVNULL,
-        )
-        log.info("Finished")
-        log.info("Attempt copying to Johann")
-        with open("final_location.txt", "r", encoding="utf-8") as f:
-            dst = Path(f.read().strip())
-        global filename
-        src = Path(filename)
-        if dst.is_dir():
-            shutil.copytree(src.parent, dst / src.parent.name)
+        try:
+            self.meter.ChA.source_voltage = 0
+            self.meter.ChA.source_output = "OFF"
+            if self.dual_channel:
+                self.meter.ChB.source_voltage = 0
+                self.meter.ChB.source_output = "OFF"
+            self.notifier.send("FINISHED")
+            log.info("Finished")
+        finally:
+            # Also after a failed startup, the mirror thread must end
+            if self.mirror is not None:
+                log.info("Finishing the copy to Johann in the background")
+                self.mirror.finish()
+
+    def start_mirror(self):
+        """Mirrors the run folder to the location in final_location.txt."""
+        self.mirror = None
+        if self.data_filename is None:
+            return
+        try:
+            with open("final_location.txt", "r", encoding="utf-8") as f:
+                dst = Path(f.read().strip())
+        except OSError:
+            log.info("No final_location.txt, results are not copied")
+            return
+        src = Path(self.data_filename).parent
+        if not dst.is_dir():
+            log.warning(f"Final location {dst} is not reachable")
+            return
+
+        def plot_results():
             subprocess.Popen(
                 [sys.executable, "plot_ep_results.py", str(dst)],
                 stdout=subprocess.DEVNULL,
             )
 
+        self.mirror = ResultsMirror(src, dst / src.name, on_done=plot_results)
+        self.mirror.start()
+
 
 class MainWindow(ManagedWindow):
     def __init__(self):
         super().__init__(
             procedure_class=Electroplating,
             inputs=[
-                # "measure_voltage",
+                "measure_voltage",
                 "material_sel",
                 "membrane_sel",
                 "charge_stop",
@@ -445,17 +588,31 @@ class MainWindow(ManagedWindow):
                 "nw_height",
                 "photo_height",
                 "pulse",
+                "instrument_timed",
                 # "max_current",
                 "total_time",
+                "emit_decimation",
+                "binary_results",
+                "timing_report",
+                "fast_reads",
                 "pulse_width",
                 "pulse_height",
                 "pause_width",
                 "pause_height",
                 "voltage",
                 "sample_notes",
+                "dual_channel",
+                "voltage_b",
+                "pulse_width_b",
+                "pulse_height_b",
+                "pause_width_b",
+                "pause_height_b",
+                "max_charge_b",
+                "sample_notes_b",
             ],
             displays=[
-                # "measure_voltage",
+                "measure_voltage",
+                "dual_channel",
                 # "charge_stop",
                 # "nw_charge_stop",
                 # "max_charge",
@@ -505,6 +662,7 @@ class MainWindow(ManagedWindow):
         filename = unique_filename(directory, prefix="EP")
         print(filename)
         procedure = self.make_procedure()
+        procedure.data_filename = filename
         # print(procedure)
         results = Results(procedure, filename)
         experiment = self.new_experiment(results)
@@ -513,8 +671,5 @@ class MainWindow(ManagedWindow):
 
 
 if __name__ == "__main__":
-    app = QtWidgets.QApplication(sys.argv)
-    QLocale.setDefault(QLocale(QLocale.English, QLocale.UnitedStates))
-    window = MainWindow()
-    window.show()
+    app, window = launch(MainWindow, prefetch_visa=PREFETCH_VISA)
     sys.exit(app.exec_())
@@ -0,0 +1,193 @@
+"""
+Decimating emit stage between an acquisition loop and Procedure.emit.
+
+The loop pushes plain tuples in DATA_COLUMNS order. The pymeasure Worker
+records results one dict at a time, so every emitted row is one emit; without
+decimation rows are emitted as they are pushed. With decimation > 1 rows are
+buffered until batch_size rows are waiting or batch_interval seconds passed,
+and only the minimum and maximum row of every group of `decimation` samples
+is emitted, so pulse envelopes stay visible in the plot. The results CSV then
+holds only these rows too; the full-rate rows are written in blocks to a
+separate CSV file. With binary set the full-rate rows go to a binary columnar
+file instead, whether the emitted stream is decimated or not.
+Progress updates are throttled to one per progress_interval seconds.
+With a LoopTimer the emit and disk time of every batch and the time the
+pymeasure recorder takes per results row are recorded.
+
+Data that does not go through the pymeasure Worker, like the second channel
+of a dual channel run, is written with a ResultsWriter as the emit target.
+
+The plating procedures get the parameters of this pipeline (decimation,
+binary file, timing report, fast reads) from PipelineParameters.
+"""
+
+from pathlib import Path
+from time import perf_counter
+import numpy as np
+from pymeasure.experiment import BooleanParameter, IntegerParameter, Results
+from downsample import minmax_decimate
+from columnar_results import ColumnarWriter, columnar_filename, procedure_metadata
+from loop_timing import LoopTimer, time_recorder
+
+
+def full_rate_filename(filename):
+    """Name of the full-rate companion file of a results file."""
+    filename = Path(filename)
+    return filename.with_name(filename.stem + "_full.csv")
+
+
+class PipelineParameters:
+    """Acquisition pipeline parameters, mixed into the plating procedures.
+
+    Results file and plot keep the min/max of every emit_decimation samples,
+    the full rate goes to the _full file. timing_report saves the LoopTimer
+    report next to the results, fast_reads reads with fast_read.py.
+    """
+
+    emit_decimation = IntegerParameter(
+        "Results Decimation (min/max of N)", default=1, minimum=1
+    )
+    binary_results = BooleanParameter("Binary Full-Rate File", default=False)
+    timing_report = BooleanParameter("Timing Report", default=False)
+    fast_reads = BooleanParameter("Fast Binary Reads", default=True)
+    # A list here gets the time of every sample pushed into the EmitStage,
+    # before decimation, e.g. for benchmark_acquisition.py
+    sample_times = None
+
+
+class CSVSink:
+    """Appends blocks of rows to a plain CSV file."""
+
+    def __init__(self, filename, columns):
+        self.file = open(filename, "w", encoding="utf-8", newline="")
+        self.file.write(",".join(columns) + "\n")
+
+    def write(self, block):
+        np.savetxt(self.file, block, delimiter=",", fmt="%.9g")
+
+    def close(self):
+        self.file.close()
+
+
+class ResultsWriter:
+    """Writes emitted results to a pymeasure results file of their own.
+
+    Use writer.emit as procedure.emit; the header holds the parameters of
+    procedure, so the file reads like any other results file.
+    """
+
+    def __init__(self, procedure, filename):
+        self.results = Results(procedure, str(filename))
+        self.file = open(filename, "a", encoding="utf-8")
+
+    def emit(self, topic, record):
+        if topic == "results":
+            self.file.write(self.results.format(record) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+class EmitStage:
+    def __init__(
+        self,
+        procedure,
+        columns=None,
+        decimation=1,
+        results_file=None,
+        binary=False,
+        y_index=1,
+        batch_size=200,
+        batch_interval=0.2,
+        progress_interval=0.5,
+        timer=None,
+    ):
+        self.procedure = procedure
+        self.columns = list(columns or procedure.DATA_COLUMNS)
+        self.decimation = max(1, int(decimation))
+        self.y_index = y_index
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.progress_interval = progress_interval
+        self.timer = timer or LoopTimer(enabled=False)
+        time_recorder(procedure, self.timer)
+        self.sample_times = getattr(procedure, "sample_times", None)
+        self.sink = None
+        if results_file is not None and binary:
+            self.sink = ColumnarWriter(
+                columnar_filename(results_file),
+                self.columns,
+                procedure_metadata(procedure),
+            )
+        elif results_file is not None and self.decimation > 1:
+            self.sink = CSVSink(full_rate_filename(results_file), self.columns)
+        self.rows = []
+        self.written = 0
+        self.last_flush = perf_counter()
+        self.last_progress = 0
+
+    def push(self, *values):
+        """Adds one sample, values in column order."""
+        if self.sample_times is not None:
+            self.sample_times.append(values[0])
+        if self.decimation == 1:
+            self.procedure.emit("results", dict(zip(self.columns, values)))
+            if self.sink is None:
+                return
+        self.rows.append(values)
+        if (
+            len(self.rows) >= self.batch_size
+            or perf_counter() - self.last_flush >= self.batch_interval
+        ):
+            self.flush()
+
+    def push_block(self, *columns):
+        """Adds a block of samples given as one array per column."""
+        if self.sample_times is not None:
+            self.sample_times.extend(columns[0])
+        rows = np.column_stack(columns).astype(float).tolist()
+        if self.decimation == 1:
+            self.emit_rows(rows)
+            if self.sink is None:
+                return
+        self.rows.extend(rows)
+        self.flush()
+
+    def progress(self, percent):
+        now = perf_counter()
+        if now - self.last_progress >= self.progress_interval:
+            self.procedure.emit("progress", percent)
+            self.last_progress = now
+
+    def flush(self, final=False):
+        self.last_flush = perf_counter()
+        if not self.rows:
+            return
+        block = np.asarray(self.rows, dtype=float)
+        if self.sink is not None:
+            start = perf_counter()
+            self.sink.write(block[self.written :])
+            self.timer.record("disk", perf_counter() - start)
+        if self.decimation == 1:
+            # Emitted when pushed, the rows were only kept for the sink
+            self.rows = []
+            return
+        if not final:
+            block, leftover = minmax_decimate(block, self.decimation, self.y_index)
+            self.rows = [tuple(row) for row in leftover]
+        else:
+            self.rows = []
+        self.written = len(self.rows)
+        self.emit_rows(block.tolist())
+
+    def emit_rows(self, rows):
+        start = perf_counter()
+        for row in rows:
+            self.procedure.emit("results", dict(zip(self.columns, row)))
+        self.timer.record("emit", perf_counter() - start)
+
+    def close(self):
+        self.flush(final=True)
+        if self.sink is not None:
+            self.sink.close()
+            self.sink = None
@@ -0,0 +1,156 @@
+"""
+Raw fast-path measurement reads for the source meters.
+
+The pymeasure properties (meter.current, meter.ChA.current) send an ASCII
+query, parse the string and check the value on every sample. The readers here
+write the measurement command straight to the VISA session, get the answer in
+the binary single precision format of the instrument and decode it with NumPy.
+Setup stays with pymeasure; configure() switches the data format and
+restore() switches it back to ASCII, which the pymeasure properties need.
+With binary=False the same commands are read as ASCII.
+
+With measure_voltage the output voltage is read in the same transaction as
+the current: :FORM:ELEM VOLT,CURR on the 2400, the source value of the reading
+buffer on the 2450 and smuX.measure.iv() on the 2600. read() returns
+(current in A, voltage in V or None if it is not measured).
+"""
+
+import logging
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+
+def decode_block(raw, dtype="<f4"):
+    """Values of an IEEE 488.2 binary block, #0... or #<n><length>..."""
+    if raw[:1] != b"#":
+        raise ValueError(f"Not a binary block: {raw[:20]!r}")
+    digits = int(raw[1:2])
+    size = np.dtype(dtype).itemsize
+    if digits == 0:
+        # Indefinite length, whatever follows the values is the terminator
+        start = 2
+        length = (len(raw) - start) // size * size
+    else:
+        start = 2 + digits
+        length = int(raw[2:start])
+    return np.frombuffer(raw, dtype=dtype, count=length // size, offset=start)
+
+
+def decode_ascii(raw):
+    return np.asarray(raw.decode("ascii").strip().split(","), dtype=float)
+
+
+class FastReader:
+    READ = None
+    BINARY = ()
+    ASCII = ()
+    # Order of a combined reading
+    VOLTAGE_FIRST = True
+
+    def __init__(self, meter, measure_voltage=False, binary=True):
+        self.meter = meter
+        self.connection = meter.adapter.connection
+        self.measure_voltage = measure_voltage
+        self.binary = binary
+
+    def configure(self):
+        if self.binary:
+            for command in self.BINARY:
+                self.connection.write(command)
+
+    def restore(self):
+        if self.binary:
+            for command in self.ASCII:
+                self.connection.write(command)
+
+    def read_values(self):
+        self.connection.write(self.READ)
+        if not self.binary:
+            return decode_ascii(self.connection.read_raw())
+        # Binary data may contain the termination character, read up to END
+        with self.connection.read_termination_context(None):
+            return decode_block(self.connection.read_raw())
+
+    def read(self):
+        values = self.read_values()
+        if not self.measure_voltage:
+            return float(values[0]), None
+        if self.VOLTAGE_FIRST:
+            return float(values[1]), float(values[0])
+        return float(values[0]), float(values[1])
+
+
+class FastReader2400(FastReader):
+    """:READ? of the elements set by :FORM:ELEM (CURR or VOLT,CURR)."""
+
+    READ = ":READ?"
+    BINARY = (":FORM:DATA REAL,32", ":FORM:BORD SWAP")
+    ASCII = (":FORM:DATA ASC",)
+
+
+class FastReader2450(FastReader):
+    """SCPI mode 2450/2460/2470; REAL is double there, SREal is single.
+
+    The source value of a reading is the measured output voltage when source
+    readback is on (:SOUR:VOLT:READ:BACK ON, the default).
+    """
+
+    BINARY = (":FORM:DATA SRE", ":FORM:BORD SWAP")
+    ASCII = (":FORM:DATA ASC",)
+
+    @property
+    def READ(self):
+        if self.measure_voltage:
+            return ':READ? "defbuffer1", SOUR, READ'
+        return ":READ?"
+
+
+class FastReader2600(FastReader):
+    """TSP printnumber of one SMU measurement in REAL32."""
+
+    VOLTAGE_FIRST = False
+
+    BINARY = ("format.data = format.REAL32", "format.byteorder = format.LITTLEENDIAN")
+    ASCII = ("format.data = format.ASCII",)
+
+    def __init__(self, meter, measure_voltage=False, binary=True, channel="a"):
+        super().__init__(meter, measure_voltage, binary)
+        smu = f"smu{channel}"
+        if measure_voltage:
+            self.READ = f"printnumber({smu}.measure.iv())"
+        else:
+            self.READ = f"printnumber({smu}.measure.i())"
+
+
+class DualReader2600(FastReader2600):
+    """Both SMUs of a 2600 in one transaction.
+
+    read() returns (current_a, voltage_a, current_b, voltage_b). In a Lua
+    argument list only the last call expands to all its values, so the iv()
+    results go through locals first.
+    """
+
+    def __init__(self, meter, measure_voltage=False, binary=True):
+        FastReader.__init__(self, meter, measure_voltage, binary)
+        if measure_voltage:
+            self.READ = (
+                "do local ia, va = smua.measure.iv() "
+                "local ib, vb = smub.measure.iv() "
+                "printnumber(ia, va, ib, vb) end"
+            )
+        else:
+            self.READ = "printnumber(smua.measure.i(), smub.measure.i())"
+
+    def read(self):
+        values = [float(v) for v in self.read_values()]
+        if self.measure_voltage:
+            return tuple(values[:4])
+        return values[0], None, values[1], None
+
+
+FAST_READERS = {
+    "Keithley2400": FastReader2400,
+    "Keithley2450": FastReader2450,
+    "Keithley2600": FastReader2600,
+}
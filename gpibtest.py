@@ -1,6 +1,25 @@
-import pyvisa
+"""
+Lists the instruments on the VISA bus with their identity.
 
-rm = pyvisa.ResourceManager()
-print(rm.list_resources())
-inst = rm.open_resource(rm.list_resources()[2])
-print(inst.query("*IDN?"))
+    python gpibtest.py            # revalidate the cached instruments
+    python gpibtest.py --rescan   # probe every address again
+"""
+
+import argparse
+import logging
+from visa_registry import VisaRegistry
+
+parser = argparse.ArgumentParser(description="List VISA instruments")
+parser.add_argument("--rescan", action="store_true")
+parser.add_argument("--serial", action="store_true", help="also probe serial ports")
+parser.add_argument("--timeout", type=float, default=0.3, help="probe timeout in s")
+args = parser.parse_args()
+logging.basicConfig(level=logging.INFO)
+
+registry = VisaRegistry(timeout=args.timeout, serial=args.serial)
+if args.rescan or not registry.entries:
+    registry.scan()
+else:
+    registry.revalidate()
+for address, idn in registry.entries.items():
+    print(f"{address:30} {idn['vendor']} {idn['model']} {idn['serial']}")
@@ -0,0 +1,111 @@
+"""
+Opens the instruments used by the procedures.
+
+Set the environment variable EP_SIMULATE=1 to get the simulated instruments of
+simulated_instruments.py instead of real ones. EP_SIMULATE may also point to a
+JSON file with keyword arguments for them, e.g.
+{"latency": 0.004, "jitter": 0.001, "noise": 1e-6, "series_resistance": 10}
+
+pyvisa is only imported, and the bus only enumerated, when an instrument is
+opened or prefetch_resources() is called.
+"""
+
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+MODELS = {
+    "Keithley2400": "pymeasure.instruments.keithley",
+    "Keithley2450": "pymeasure.instruments.keithley",
+    "Keithley2600": "pymeasure.instruments.keithley",
+    "HP34401A": "pymeasure.instruments.hp",
+}
+
+
+def simulation_settings():
+    """Returns the simulator keyword arguments, or None when not simulating."""
+    setting = os.environ.get("EP_SIMULATE", "")
+    if setting in ("", "0"):
+        return None
+    if Path(setting).is_file():
+        with open(setting, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+
+_resource_manager = None
+_resources = None
+_visa_lock = threading.Lock()
+
+
+def resource_manager():
+    """The pyvisa ResourceManager of this process, created on first use."""
+    global _resource_manager
+    with _visa_lock:
+        if _resource_manager is None:
+            import pyvisa
+
+            _resource_manager = pyvisa.ResourceManager()
+        return _resource_manager
+
+
+def list_resources(refresh=False):
+    """VISA resources, enumerated once per process unless refresh is set."""
+    global _resources
+    rm = resource_manager()
+    with _visa_lock:
+        if _resources is None or refresh:
+            _resources = rm.list_resources()
+        return _resources
+
+
+def _prefetch():
+    from visa_registry import get_registry
+
+    registry = get_registry()
+    if registry.entries:
+        registry.revalidate()
+    else:
+        registry.scan()
+
+
+def prefetch_resources():
+    """Checks the instrument registry in the background, e.g. once the GUI is up."""
+    if simulation_settings() is not None:
+        return
+    threading.Thread(target=_prefetch, name="visa prefetch", daemon=True).start()
+
+
+def open_instrument(model, address=None):
+    """Opens model ("Keithley2400", ...) at address.
+
+    Without an address the instrument is looked up by its identity in the
+    VISA registry (visa_registry.py). Opening holds the registry lock and the
+    address is not probed by the registry while the instrument is alive. The
+    session keeps an exclusive VISA lock, so the probes of other processes
+    skip it too.
+    """
+    settings = simulation_settings()
+    if settings is not None:
+        from simulated_instruments import SIMULATED
+
+        log.info(f"Using simulated {model}")
+        return SIMULATED[model](address, **settings)
+    from visa_registry import get_registry
+
+    registry = get_registry()
+    with registry.lock:
+        if address is None:
+            address = registry.address(model)
+        module = __import__(MODELS[model], fromlist=[model])
+        instrument = getattr(module, model)(address)
+        try:
+            instrument.adapter.connection.lock_excl()
+        except Exception as e:
+            log.warning(f"Could not lock {address}, other processes may probe it: {e}")
+        registry.mark_open(address, instrument)
+    return instrument
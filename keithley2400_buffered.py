@@ -0,0 +1,268 @@
+"""
+Instrument-timed pulse plating on the Keithley 2400.
+
+The pulse/pause levels are programmed as a :SOUR:VOLT:LIST and run through the
+trigger model, so every source point and reading is paced by the instrument.
+Readings are stored in the trace buffer and read back in blocks with
+:TRAC:DATA?.
+
+Staircase2400 does the same for the voltage staircase of bubble plating: every
+hold and rest segment is paced by the trigger model and buffered, the host
+only switches the level when a segment is complete and pulls the blocks.
+"""
+
+import logging
+from time import sleep, perf_counter
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+LIST_POINTS = 100
+BUFFER_POINTS = 2500
+# Fixed overhead of one source-measure point with autozero and display off
+POINT_OVERHEAD = 0.0005
+
+
+def parse_trace(response, elements=3):
+    """Splits an ASCII :TRAC:DATA? response into one array per element."""
+    values = np.asarray(response.strip().split(","), dtype=float)
+    return values.reshape(-1, elements).T
+
+
+class PulseList2400:
+    """Runs pulse/pause cycles as a list sweep in blocks of whole cycles.
+
+    Each block holds as many complete cycles as fit into the trace buffer and
+    ends on the pause level, which is also the bias level the source returns
+    to while the host reads the block. Widths and intervals are in seconds.
+    """
+
+    def __init__(self, meter, line_frequency=50):
+        self.meter = meter
+        self.line_frequency = line_frequency
+        self.points = 0
+        # Source level of every point of a block
+        self.levels = np.empty(0)
+        self.block_time = 0
+        self.block_start = 0
+        self.started = False
+
+    def configure(
+        self,
+        pulse_height,
+        pulse_width,
+        pause_height,
+        pause_width,
+        sample_interval,
+        nplc,
+    ):
+        period = pulse_width + pause_width
+        sample_interval = max(sample_interval, period / LIST_POINTS)
+        pulse_points = max(1, round(pulse_width / sample_interval))
+        pause_points = max(1, round(pause_width / sample_interval))
+        if pulse_points + pause_points > LIST_POINTS:
+            pause_points = LIST_POINTS - pulse_points
+        levels = [pulse_height] * pulse_points + [pause_height] * pause_points
+        cycles = max(1, BUFFER_POINTS // len(levels))
+        self.points = cycles * len(levels)
+        self.levels = np.tile(levels, cycles)
+        measure_time = nplc / self.line_frequency + POINT_OVERHEAD
+        delay = max(0, sample_interval - measure_time)
+        self.block_time = self.points * max(sample_interval, measure_time)
+        log.info(
+            f"Pulse list: {pulse_points}+{pause_points} points of "
+            f"{sample_interval * 1000:.2f} ms, {cycles} cycles per block"
+        )
+        coms = [
+            f":SOUR:VOLT:LEV {pause_height}",
+            ":SOUR:VOLT:MODE LIST",
+            ":SOUR:LIST:VOLT " + ",".join(f"{v:g}" for v in levels),
+            ":SOUR:DEL 0",
+            ":ARM:SOUR IMM",
+            f":ARM:COUN {cycles}",
+            ":TRIG:SOUR IMM",
+            f":TRIG:COUN {len(levels)}",
+            f":TRIG:DEL {delay:.6f}",
+            ":FORM:ELEM VOLT,CURR,TIME",
+            ":TRAC:TST:FORM ABS",
+            f":TRAC:POIN {self.points}",
+            ":TRAC:FEED SENS",
+        ]
+        for c in coms:
+            self.meter.write(c)
+            sleep(0.01)
+
+    def start_block(self):
+        if not self.started:
+            self.meter.write(":SYST:TIME:RES")
+            self.started = True
+        self.meter.write(":TRAC:CLE")
+        self.meter.write(":TRAC:FEED:CONT NEXT")
+        self.meter.write(":INIT")
+        self.block_start = perf_counter()
+
+    def wait_block(self, should_stop, poll_interval=0.05):
+        """Sleeps until the running block should be done.
+
+        Returns False if should_stop() fired while waiting.
+        """
+        while perf_counter() - self.block_start < self.block_time:
+            if should_stop():
+                return False
+            sleep(poll_interval)
+        return True
+
+    def read_block(self):
+        """Returns (times, currents, voltages) of the finished block.
+
+        Times are instrument timestamps since the first block started,
+        currents are in A. Points without a voltage measurement (9.91e37)
+        get the list level they were sourced at.
+        """
+        self.meter.ask("*OPC?")
+        volts, currents, times = parse_trace(self.meter.ask(":TRAC:DATA?"))
+        volts = np.where(volts > 1e37, self.levels[: len(volts)], volts)
+        return times, currents, volts
+
+    def abort(self):
+        self.meter.write(":ABOR")
+        self.meter.write(":SOUR:VOLT:MODE FIXED")
+
+
+class Staircase2400:
+    """Runs a list of constant level segments with buffered, paced readings.
+
+    A segment is (level, duration, interval) in V and s. Its readings are
+    taken every interval by the trigger model, in blocks that fit into the
+    trace buffer. An interval of None holds the level without readings; a
+    level of None turns the output off for the duration, also without.
+
+    Every segment lasts its duration from the moment its level was set. The
+    blocks are sized to the time left in the segment, so reading a block back
+    and re-arming the trigger model shorten the readings of a segment, not
+    lengthen the segment; no readings are taken during that time. The next
+    level is set right after the last block that fits, before it is read
+    back, so a segment ends late by at most one *OPC? round trip.
+    """
+
+    def __init__(self, meter, nplc, line_frequency=50):
+        self.meter = meter
+        self.measure_time = nplc / line_frequency + POINT_OVERHEAD
+        self.output = False
+        # Host time to arm a block and from the end of one block to the next
+        self.arm_time = 0.0
+        self.rearm_time = 0.0
+
+    def configure(self):
+        coms = [
+            ":SOUR:VOLT:MODE FIXED",
+            ":SOUR:DEL 0",
+            ":ARM:SOUR IMM",
+            ":ARM:COUN 1",
+            ":TRIG:SOUR IMM",
+            ":FORM:ELEM VOLT,CURR,TIME",
+            ":TRAC:TST:FORM ABS",
+            ":TRAC:FEED SENS",
+        ]
+        for c in coms:
+            self.meter.write(c)
+            sleep(0.01)
+        start = perf_counter()
+        self.meter.write(":TRAC:CLE")
+        # First estimate, arming a block takes six writes
+        self.arm_time = 6 * (perf_counter() - start)
+
+    def next_block(self, remaining, interval):
+        """(points, trigger delay, last) of the next block, 0 points for none.
+
+        The last block of a segment spreads its points over the time left, so
+        it ends with the segment.
+        """
+        period = max(interval, self.measure_time)
+        points = round(remaining / period)
+        if points > BUFFER_POINTS:
+            return BUFFER_POINTS, period - self.measure_time, False
+        points = max(points, 1)
+        if remaining / points < self.measure_time:
+            return 0, 0, True
+        return points, remaining / points - self.measure_time, True
+
+    def set_level(self, level):
+        if level is None:
+            self.meter.write(":OUTP OFF")
+            self.output = False
+            return
+        self.meter.write(f":SOUR:VOLT:LEV {level}")
+        if not self.output:
+            self.meter.write(":OUTP ON")
+            self.output = True
+
+    def wait_until(self, end, should_stop, poll_interval):
+        """Sleeps until perf_counter() reaches end, False when stopped."""
+        while perf_counter() < end:
+            if should_stop():
+                return False
+            sleep(min(poll_interval, max(end - perf_counter(), 0)))
+        return True
+
+    def run(self, segments, should_stop, poll_interval=0.05):
+        """Yields (segment index, times, currents, voltages) per block.
+
+        Times are instrument timestamps since the start, currents are in A.
+        Stops early, with the output off, when should_stop() fires.
+        """
+        self.meter.write(":SYST:TIME:RES")
+        self.set_level(segments[0][0])
+        edge = perf_counter()
+        for k, (level, duration, interval) in enumerate(segments):
+            following = segments[k + 1][0] if k + 1 < len(segments) else None
+            end = edge + duration
+            switched = False
+            last = level is None or interval is None
+            rearm_from = None
+            while not last:
+                arm_start = perf_counter()
+                points, delay, last = self.next_block(
+                    end - arm_start - self.arm_time, interval
+                )
+                if points == 0:
+                    break
+                self.meter.write(f":TRIG:COUN {points}")
+                self.meter.write(f":TRIG:DEL {delay:.6f}")
+                self.meter.write(f":TRAC:POIN {points}")
+                self.meter.write(":TRAC:CLE")
+                self.meter.write(":TRAC:FEED:CONT NEXT")
+                self.meter.write(":INIT")
+                self.arm_time = perf_counter() - arm_start
+                if rearm_from is not None:
+                    self.rearm_time = perf_counter() - rearm_from
+                block_end = perf_counter() + points * (delay + self.measure_time)
+                if not self.wait_until(block_end, should_stop, poll_interval):
+                    self.abort()
+                    return
+                self.meter.ask("*OPC?")
+                rearm_from = perf_counter()
+                if (
+                    end - rearm_from
+                    < max(interval, self.measure_time) + self.rearm_time
+                ):
+                    # No room for another block, switch before reading back
+                    last = True
+                if last:
+                    self.set_level(following)
+                    edge = perf_counter()
+                    switched = True
+                volts, currents, times = parse_trace(self.meter.ask(":TRAC:DATA?"))
+                yield k, times, currents, volts
+            if switched:
+                continue
+            # Nothing (more) to measure, the host waits out the segment
+            if not self.wait_until(end, should_stop, poll_interval):
+                self.abort()
+                return
+            self.set_level(following)
+            edge = perf_counter()
+
+    def abort(self):
+        self.meter.write(":ABOR")
+        self.set_level(None)
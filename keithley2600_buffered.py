@@ -0,0 +1,178 @@
+"""
+Instrument-timed pulse plating on the Keithley 2600.
+
+A TSP script is uploaded once and runs the pulse/pause train on the instrument.
+The edge times come from the instrument timer on an absolute timeline, every
+reading goes into smuX.nvbuffer1 together with its timestamp and source value
+and the buffer is printed in bulk chunks. The host only drains those chunks.
+
+Edges are checked between readings, and printing a chunk (printbuffer) runs in
+the same loop, so an edge due during a flush is set when the flush returns:
+up to one print time late, a few ms for a chunk of 500 readings over GPIB.
+The phase running at that moment is cut short by the delay, the next edges
+stay on the timeline. If a stall spans whole edges, the missed periods are
+skipped and the level of the phase due at that time is set once, instead of
+firing the missed edges back to back as pulses and pauses of near zero width.
+Larger chunk_size and flush_interval values mean fewer, but longer, stalls.
+With measure_voltage the output voltage is measured together with the current
+(smuX.measure.iv into nvbuffer2) and printed instead of the source value.
+"""
+
+import logging
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+SCRIPT_NAME = "EPPulseTrain"
+END_MARKER = "EP_END"
+
+# One line per TSP statement, written between loadscript and endscript.
+PULSE_TRAIN_TSP = """
+function ep_flush(buf, vbuf, t0)
+    if buf.n > 0 then
+        print(string.format("%.7e", t0))
+        if vbuf then
+            printbuffer(1, buf.n, buf.timestamps, buf.readings, vbuf.readings)
+            vbuf.clear()
+        else
+            printbuffer(1, buf.n, buf.timestamps, buf.readings, buf.sourcevalues)
+        end
+        buf.clear()
+    end
+end
+function ep_pulse_train(smu, pulse_v, pulse_w, pause_v, pause_w, total_t, chunk, flush_t, measure_v)
+    local buf = smu.nvbuffer1
+    buf.clear()
+    buf.appendmode = 1
+    buf.collecttimestamps = 1
+    buf.collectsourcevalues = 1
+    local vbuf = nil
+    if measure_v == 1 then
+        vbuf = smu.nvbuffer2
+        vbuf.clear()
+        vbuf.appendmode = 1
+    end
+    smu.measure.count = 1
+    format.data = format.ASCII
+    format.asciiprecision = 7
+    timer.reset()
+    local in_pulse = false
+    local next_edge = pause_w
+    local period = pulse_w + pause_w
+    smu.source.levelv = pause_v
+    smu.source.output = smu.OUTPUT_ON
+    local t = timer.measure.t()
+    local t0 = t
+    local last_flush = t
+    while t < total_t do
+        if t >= next_edge then
+            local was_pulse = in_pulse
+            next_edge = next_edge + math.floor((t - next_edge) / period) * period
+            while t >= next_edge do
+                in_pulse = not in_pulse
+                if in_pulse then
+                    next_edge = next_edge + pulse_w
+                else
+                    next_edge = next_edge + pause_w
+                end
+            end
+            if in_pulse ~= was_pulse then
+                if in_pulse then
+                    smu.source.levelv = pulse_v
+                else
+                    smu.source.levelv = pause_v
+                end
+            end
+        end
+        if buf.n == 0 then
+            t0 = timer.measure.t()
+        end
+        if vbuf then
+            smu.measure.iv(buf, vbuf)
+        else
+            smu.measure.i(buf)
+        end
+        t = timer.measure.t()
+        if buf.n >= chunk or t - last_flush >= flush_t then
+            ep_flush(buf, vbuf, t0)
+            last_flush = t
+        end
+    end
+    ep_flush(buf, vbuf, t0)
+    smu.source.levelv = pause_v
+    print("EP_END")
+end
+"""
+
+
+class PulseTrain2600:
+    """Runs the pulse/pause train of one SMU channel on the instrument.
+
+    Usage::
+
+        train = PulseTrain2600(meter, "a")
+        train.load()
+        train.start(pulse_height, pulse_width, pause_height, pause_width, total_time)
+        while (chunk := train.read_chunk()) is not None:
+            times, currents, voltages = chunk
+
+    Widths and times are in seconds, currents are returned in A.
+    """
+
+    def __init__(
+        self,
+        meter,
+        channel="a",
+        chunk_size=500,
+        flush_interval=0.1,
+        measure_voltage=False,
+    ):
+        self.meter = meter
+        self.channel = channel
+        self.measure_voltage = measure_voltage
+        self.chunk_size = chunk_size
+        self.flush_interval = flush_interval
+        self.running = False
+
+    def load(self):
+        """Uploads the pulse train script, replacing an older copy."""
+        self.meter.write(f"loadscript {SCRIPT_NAME}")
+        for line in PULSE_TRAIN_TSP.strip().splitlines():
+            self.meter.write(line)
+        self.meter.write("endscript")
+        self.meter.write(f"{SCRIPT_NAME}()")
+
+    def start(self, pulse_height, pulse_width, pause_height, pause_width, total_time):
+        """Starts the script; it runs until total_time or until aborted."""
+        self.meter.write(
+            f"ep_pulse_train(smu{self.channel}, {pulse_height}, {pulse_width}, "
+            f"{pause_height}, {pause_width}, {total_time}, "
+            f"{int(self.chunk_size)}, {self.flush_interval}, "
+            f"{int(self.measure_voltage)})"
+        )
+        self.running = True
+
+    def read_chunk(self):
+        """Blocks for the next printed chunk.
+
+        Returns a tuple of (times, currents, voltages) arrays, with times on the
+        instrument timeline of the run, or None once the script finished.
+        """
+        if not self.running:
+            return None
+        line = self.meter.read().strip()
+        if line == END_MARKER:
+            self.running = False
+            return None
+        t0 = float(line)
+        values = np.asarray(self.meter.read().strip().split(","), dtype=float)
+        values = values.reshape(-1, 3)
+        return t0 + values[:, 0], values[:, 1], values[:, 2]
+
+    def abort(self):
+        """Stops a running script with a device clear and empties the output queue."""
+        if not self.running:
+            return
+        self.meter.adapter.connection.clear()
+        self.running = False
+        log.info("Aborted instrument pulse train")
@@ -0,0 +1,97 @@
+"""
+Starts a measurement GUI with the window first and the heavy imports after.
+
+    python launcher.py electroplating2600
+    python launcher.py electroplating2600 --profile
+
+A splash screen is shown as soon as PyQt5 is loaded, then the script module
+(pymeasure, pandas, NumPy, ...) is imported and its MainWindow shown. Scripts
+that look their instrument up by identity set PREFETCH_VISA = True; for them
+the VISA registry is checked in the background once the window is up, the
+others never probe the bus. With --profile the import-time profile of the
+script (python -X importtime) is printed instead, slowest imports first.
+
+The scripts call launch() from their own __main__ block too.
+"""
+
+import argparse
+import importlib
+import subprocess
+import sys
+
+
+def import_profile(module, top=30):
+    """Returns [(cumulative us, self us, name)] of importing module, slowest first."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative, name = line[len("import time:") :].split("|")
+        rows.append((int(cumulative), int(self_us), name.rstrip()))
+    if proc.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{proc.stderr[-2000:]}")
+    rows.sort(reverse=True)
+    return rows[:top]
+
+
+def launch(window_class, prefetch_visa=False):
+    """Creates the application and shows window_class; returns (app, window).
+
+    With prefetch_visa the VISA registry is revalidated, or the bus scanned,
+    in the background.
+    """
+    from PyQt5.QtCore import QLocale
+    from PyQt5.QtWidgets import QApplication
+    from instruments import prefetch_resources
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    QLocale.setDefault(QLocale(QLocale.English, QLocale.UnitedStates))
+    window = window_class()
+    window.show()
+    if prefetch_visa:
+        prefetch_resources()
+    return app, window
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Start a measurement GUI")
+    parser.add_argument("script", help="module name, e.g. electroplating2600")
+    parser.add_argument(
+        "--profile", action="store_true", help="print the import-time profile"
+    )
+    parser.add_argument("--top", type=int, default=30)
+    args = parser.parse_args()
+    script = args.script
+    if script.endswith(".py"):
+        script = script[:-3]
+
+    if args.profile:
+        print(f"{'cumulative ms':>14} {'self ms':>8}  module")
+        for cumulative, self_us, name in import_profile(script, args.top):
+            print(f"{cumulative / 1000:14.1f} {self_us / 1000:8.1f}  {name}")
+        return
+
+    from PyQt5.QtCore import Qt
+    from PyQt5.QtGui import QPixmap
+    from PyQt5.QtWidgets import QApplication, QSplashScreen
+
+    app = QApplication(sys.argv)
+    pixmap = QPixmap(360, 120)
+    pixmap.fill(Qt.darkGray)
+    splash = QSplashScreen(pixmap)
+    splash.showMessage(f"Loading {script} ...", Qt.AlignCenter, Qt.white)
+    splash.show()
+    app.processEvents()
+    module = importlib.import_module(script)
+    _, window = launch(module.MainWindow, getattr(module, "PREFETCH_VISA", False))
+    splash.finish(window)
+    sys.exit(app.exec_())
+
+
+if __name__ == "__main__":
+    main()
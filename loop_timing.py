@@ -0,0 +1,232 @@
+"""
+Opt-in timing instrumentation of the acquisition loops.
+
+LoopTimer keeps one fixed-size log histogram per metric, so memory does not
+grow with the run length and recording a value costs a log10 and an
+increment. The metrics used by the procedures are
+
+    query       duration of the instrument query of one iteration
+    period      time between the starts of two iterations
+    emit        time spent in Procedure.emit for one decimated batch
+    disk        time spent writing one block of the full-rate file
+    record      time the pymeasure recorder takes to write one results row
+    pending     samples waiting in the acquisition queue when consumed
+    edge_late   how late a pulse edge was set compared to its schedule
+
+Every report_interval seconds a one-line summary goes to the log, which the
+GUI shows. Iterations whose period exceeds gap_threshold are kept (bounded)
+with the last value of every metric, which tells whether GPIB, the GUI queue
+or the disk caused a gap. save() writes everything to <stem>_timing.json next
+to the results file. The producer and consumer threads of an acquisition
+share one LoopTimer, every update holds its lock.
+"""
+
+import json
+import logging
+import math
+import threading
+from collections import deque
+from pathlib import Path
+from time import perf_counter
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+
+def timing_filename(results_file):
+    """Name of the timing report of a results file."""
+    results_file = Path(results_file)
+    return results_file.with_name(results_file.stem + "_timing.json")
+
+
+def time_recorder(procedure, timer):
+    """Records the recorder.handle time of the worker emitting for procedure.
+
+    The pymeasure Worker writes every results row synchronously in emit(),
+    so this is the part of the emit time that goes to the results file.
+    """
+    worker = getattr(procedure.emit, "__self__", None)
+    recorder = getattr(worker, "recorder", None)
+    if not timer.enabled or recorder is None:
+        return
+    handle = recorder.handle
+
+    def timed_handle(record):
+        start = perf_counter()
+        handle(record)
+        timer.record("record", perf_counter() - start)
+
+    recorder.handle = timed_handle
+
+
+class StreamingHistogram:
+    """Histogram with logarithmic bins between lo and hi, plus exact extrema.
+
+    Negative values land in the first bin, values from 0 up to lo in the
+    second and values above hi in the last.
+    """
+
+    def __init__(self, lo=1e-6, hi=1e3, bins_per_decade=20):
+        self.lo = lo
+        self.bins_per_decade = bins_per_decade
+        self.log_lo = math.log10(lo)
+        bins = int(round((math.log10(hi) - self.log_lo) * bins_per_decade))
+        self.counts = [0] * (bins + 2)
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if value < 0:
+            self.counts[0] += 1
+            return
+        if value <= self.lo:
+            self.counts[1] += 1
+            return
+        i = int((math.log10(value) - self.log_lo) * self.bins_per_decade) + 2
+        self.counts[min(i, len(self.counts) - 1)] += 1
+
+    def edges(self):
+        """Upper bin edges, 0 for the negative bin, then lo and up."""
+        exponents = self.log_lo + np.arange(len(self.counts) - 1) / self.bins_per_decade
+        return np.concatenate([[0.0], 10**exponents])
+
+    def percentile(self, q):
+        """Upper edge of the bin holding the q-th percentile, clipped to max."""
+        if self.count == 0:
+            return math.nan
+        target = q / 100 * self.count
+        seen = 0
+        for edge, n in zip(self.edges(), self.counts):
+            seen += n
+            if seen >= target and n:
+                return min(max(edge, self.min), self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else math.nan
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "bin_edges": self.edges().tolist(),
+            "counts": list(self.counts),
+        }
+
+
+class LoopTimer:
+    """Streaming timing statistics of one acquisition run.
+
+    With enabled=False every method returns right away, so the calls can
+    stay in the loops.
+    """
+
+    METRICS = ("query", "period", "emit", "disk", "record", "pending", "edge_late")
+
+    def __init__(
+        self,
+        enabled=True,
+        report_interval=60,
+        gap_threshold=0.1,
+        max_gaps=100,
+    ):
+        self.enabled = enabled
+        self.report_interval = report_interval
+        self.gap_threshold = gap_threshold
+        self.histograms = {name: StreamingHistogram() for name in self.METRICS}
+        self.last = dict.fromkeys(self.METRICS)
+        self.gaps = deque(maxlen=max_gaps)
+        self.gap_count = 0
+        self.start = perf_counter()
+        self.last_iteration = None
+        self.last_report = self.start
+        self.lock = threading.RLock()
+
+    def record(self, name, value):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.histograms[name].add(value)
+            self.last[name] = value
+
+    def iteration(self, query_start, query_end):
+        """Records one loop iteration from the timestamps around its query."""
+        if not self.enabled:
+            return
+        with self.lock:
+            self.record("query", query_end - query_start)
+            if self.last_iteration is not None:
+                period = query_start - self.last_iteration
+                self.record("period", period)
+                if period > self.gap_threshold:
+                    gap = {"time": query_start - self.start, "period": period}
+                    gap.update(self.last)
+                    self.gaps.append(gap)
+                    self.gap_count += 1
+            self.last_iteration = query_start
+            if query_end - self.last_report < self.report_interval:
+                return
+            self.last_report = query_end
+        log.info(f"Timing: {self.summary()}")
+
+    def summary(self):
+        with self.lock:
+            return self._summary()
+
+    def _summary(self):
+        parts = []
+        for name in ("query", "period", "emit", "disk", "record", "edge_late"):
+            hist = self.histograms[name]
+            if hist.count:
+                parts.append(
+                    f"{name} p50 {1000 * hist.percentile(50):.2f} "
+                    f"p99 {1000 * hist.percentile(99):.2f} "
+                    f"max {1000 * hist.max:.2f} ms"
+                )
+        pending = self.histograms["pending"]
+        if pending.count:
+            parts.append(f"pending max {pending.max:.0f} samples")
+        if self.gap_count:
+            parts.append(f"{self.gap_count} gaps > {1000 * self.gap_threshold:.0f} ms")
+        return ", ".join(parts) or "no iterations"
+
+    def report(self):
+        with self.lock:
+            return self._report()
+
+    def _report(self):
+        return {
+            "duration": perf_counter() - self.start,
+            "gap_threshold": self.gap_threshold,
+            "gap_count": self.gap_count,
+            "metrics": {
+                name: hist.as_dict()
+                for name, hist in self.histograms.items()
+                if hist.count
+            },
+            "gaps": list(self.gaps),
+        }
+
+    def save(self, results_file):
+        """Logs the final summary and writes the report next to results_file."""
+        if not self.enabled:
+            return
+        log.info(f"Timing: {self.summary()}")
+        if results_file is None:
+            return
+        with open(timing_filename(results_file), "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=1)
@@ -1,54 +1,146 @@
+"""
+Plots current vs time for every electroplating run below a results directory.
+
+    python plot_ep_results.py <results dir> [--workers N]
+
+Runs that already have a .png next to them are skipped. What was seen is kept
+in a manifest in the results directory, so reruns only open new or modified
+files. With --workers > 1 the runs are parsed and rendered in a process pool.
+Traces are reduced to a min/max envelope (or LTTB) of about the plot width
+before rendering, so rendering time does not grow with the run length.
+"""
+
 from pathlib import Path
-import sys
-import csv
-import numpy as np
-import matplotlib.pyplot as plt
-from tqdm import tqdm
-
-print(sys.argv)
-epdir = Path(sys.argv[1])
-for csvf in tqdm(epdir.rglob("*.csv")):
-    if csvf.with_suffix(".png").is_file():
-        continue
-    print(csvf)
-    header = None
-    timelist = list()
-    currentlist = list()
-    voltlist = list()
-    chargelist = list()
-    with open(csvf, newline="\n") as csvfile:
-        csvreader = csv.reader(csvfile)
-        dec_string = next(csvreader)
-        # print(dec_string)
-        if not "Electroplating" in dec_string[0]:
-            print("here")
-            continue
-        for row in csvreader:
-            if len(row) < 2:
-                continue
-            # if not row[0].isnumeric():
-            #     continue
-            if not header:
-                header = row
-                continue
-            timelist.append(row[0])
-            currentlist.append(row[1])
-            voltlist.append(row[2])
-            chargelist.append(row[3])
-    timearr = np.asarray(timelist, dtype=float)
-    curarr = np.asarray(currentlist, dtype=float)
-    chargearr = np.asarray(chargelist, dtype=float)
-    plt.plot(timearr, curarr)
-    plt.minorticks_on()
-    plt.grid(which="major")
-    plt.title("Current vs Time")
-    plt.xlabel("Time")
-    plt.ylabel("Current (mA)")
-    plt.savefig(
-        csvf.with_suffix(".png"),
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from columnar_results import SUFFIX, load_columns
+from downsample import StreamingEnvelope, downsample
+from plot_manifest import PlotManifest, scan_runs
+from results_csv import ColumnCollector, read_procedure, reduce_csv
+
+
+def read_csv_run(csvf, mode="minmax"):
+    """Returns downsampled (time, current) of an electroplating CSV.
+
+    Returns None for other files. The min/max envelope is built while
+    streaming, the other modes need the full columns first.
+    """
+    if not "Electroplating" in read_procedure(csvf):
+        return None
+    if mode == "minmax":
+        return reduce_csv(csvf, StreamingEnvelope("Time (s)", "Current (mA)"))
+    run = reduce_csv(csvf, ColumnCollector(["Time (s)", "Current (mA)"]))
+    return downsample(*run, mode=mode)
+
+
+def read_columnar_run(colf, mode="minmax"):
+    meta, data = load_columns(colf)
+    if not "Electroplating" in meta.get("procedure", ""):
+        return None
+    return downsample(data["Time (s)"], data["Current (mA)"], mode=mode)
+
+
+def plot_current(timearr, curarr, pngf):
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.plot(timearr, curarr)
+    ax.minorticks_on()
+    ax.grid(which="major")
+    ax.set_title("Current vs Time")
+    ax.set_xlabel("Time")
+    ax.set_ylabel("Current (mA)")
+    fig.savefig(
+        pngf,
         dpi=150,
         facecolor="white",
         bbox_inches="tight",
         pad_inches=0.5,
     )
-    plt.clf()
+
+
+def plot_file(path, mode="minmax"):
+    """Plots one run; returns (path, status, message) for the summary."""
+    try:
+        if path.suffix == SUFFIX:
+            run = read_columnar_run(path, mode)
+        else:
+            run = read_csv_run(path, mode)
+        if run is None:
+            return path, "skipped", "not an electroplating run"
+        plot_current(*run, path.with_suffix(".png"))
+        return path, "plotted", f"{len(run[0])} points"
+    except Exception as e:
+        return path, "failed", f"{type(e).__name__}: {e}"
+
+
+def find_runs(manifest):
+    """Returns {path: (size, mtime)} of the new or modified runs."""
+    runs = {}
+    for path, size, mtime, has_png in scan_runs(manifest.root):
+        if manifest.needs_plot(path, size, mtime, has_png):
+            runs[path] = (size, mtime)
+    return runs
+
+
+def plot_runs(runs, workers=1, mode="minmax"):
+    """Plots all runs, serially or in a process pool, and yields each result."""
+    if workers <= 1:
+        for path in runs:
+            yield plot_file(path, mode)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(plot_file, path, mode) for path in runs]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plot electroplating results")
+    parser.add_argument("epdir", type=Path)
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="number of worker processes, 0 for one per CPU",
+    )
+    parser.add_argument(
+        "--downsample",
+        choices=["minmax", "lttb", "none"],
+        default="minmax",
+        help="reduction of the trace before plotting (default: minmax envelope)",
+    )
+    parser.add_argument(
+        "--rescan",
+        action="store_true",
+        help="ignore the manifest and check every file again",
+    )
+    args = parser.parse_args()
+    workers = args.workers or os.cpu_count()
+    manifest = PlotManifest(args.epdir)
+    if args.rescan:
+        manifest.entries = {}
+    runs = find_runs(manifest)
+    print(f"{len(runs)} runs to plot in {args.epdir} with {workers} worker(s)")
+    counts = {"plotted": 0, "skipped": 0, "failed": 0}
+    failures = []
+    try:
+        for path, status, message in plot_runs(list(runs), workers, args.downsample):
+            counts[status] += 1
+            manifest.record(path, *runs[path], status)
+            print(f"[{status}] {path}: {message}")
+            if status == "failed":
+                failures.append((path, message))
+    finally:
+        manifest.save()
+    print(", ".join(f"{n} {status}" for status, n in counts.items()))
+    for path, message in failures:
+        print(f"FAILED {path}: {message}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Manifest of the runs plot_ep_results.py has already seen.
+
+The manifest lives in the results root and records size, mtime, type and plot
+status of every results file. On a rerun the tree is only scanned with
+os.scandir; files whose size and mtime did not change are decided from the
+manifest without opening them.
+"""
+
+import json
+import os
+from pathlib import Path
+from columnar_results import SUFFIX
+
+MANIFEST_NAME = ".plot_manifest.json"
+
+
+def _columnar_stat(path):
+    """Size and mtime of a columnar run, which grows inside its directory."""
+    size = 0
+    mtime = 0
+    with os.scandir(path) as entries:
+        for entry in entries:
+            st = entry.stat()
+            size += st.st_size
+            mtime = max(mtime, st.st_mtime)
+    return size, mtime
+
+
+def scan_runs(root):
+    """Yields (path, size, mtime, has_png) of every results file below root."""
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            entries = list(it)
+        names = {entry.name for entry in entries}
+        for entry in entries:
+            if entry.is_dir():
+                if entry.name.endswith(SUFFIX):
+                    size, mtime = _columnar_stat(entry.path)
+                else:
+                    stack.append(entry.path)
+                    continue
+            elif entry.name.endswith(".csv"):
+                st = entry.stat()
+                size, mtime = st.st_size, st.st_mtime
+            else:
+                continue
+            path = Path(entry.path)
+            yield path, size, mtime, path.stem + ".png" in names
+
+
+class PlotManifest:
+    def __init__(self, root):
+        self.root = Path(root)
+        self.path = self.root / MANIFEST_NAME
+        self.entries = {}
+        self.seen = set()
+        if self.path.is_file():
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    def key(self, path):
+        return Path(path).relative_to(self.root).as_posix()
+
+    def needs_plot(self, path, size, mtime, has_png):
+        """Decides from the manifest alone whether a file has to be opened."""
+        key = self.key(path)
+        self.seen.add(key)
+        entry = self.entries.get(key)
+        if entry is None:
+            if has_png:
+                self.record(path, size, mtime, "plotted")
+                return False
+            return True
+        if entry["size"] != size or entry["mtime"] != mtime:
+            return True
+        if entry["status"] == "plotted":
+            return not has_png
+        # Unchanged files that were skipped or failed before stay that way
+        return False
+
+    def record(self, path, size, mtime, status):
+        if status == "skipped":
+            kind = "other"
+        elif Path(path).name.endswith(SUFFIX):
+            kind = "columnar"
+        else:
+            kind = "electroplating"
+        self.entries[self.key(path)] = {
+            "size": size,
+            "mtime": mtime,
+            "type": kind,
+            "status": status,
+        }
+
+    def save(self):
+        """Writes the manifest, dropping files that are gone from the tree."""
+        self.entries = {k: v for k, v in self.entries.items() if k in self.seen}
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, indent=1)
+        os.replace(tmp, self.path)
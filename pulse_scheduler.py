@@ -0,0 +1,123 @@
+"""
+Drift-free timing of host-timed pulse trains.
+
+Edges are scheduled on an absolute timeline from the run start: edge n is due
+at start + the sum of the requested phase widths before it, no matter how late
+edge n - 1 was set, so errors do not add up over a long run. Before each query
+the loop asks should_wait(); when the next edge would be due before an average
+query returns, the loop waits for the edge instead of sampling. wait_until
+sleeps for most of the wait and spins for the last part, because sleep alone
+can overshoot by a whole scheduler tick (about 15.6 ms on Windows).
+"""
+
+import sys
+from time import perf_counter, sleep
+
+SPIN = 0.016 if sys.platform == "win32" else 0.002
+
+
+def wait_until(deadline, spin=SPIN):
+    """Returns at deadline (a perf_counter time), sleeping while it is far."""
+    remaining = deadline - perf_counter()
+    if remaining > spin:
+        sleep(remaining - spin)
+    while perf_counter() < deadline:
+        pass
+
+
+class PulseScheduler:
+    """Edge schedule of a train starting with a pause at `start`.
+
+    Widths are in seconds. If the loop stalls past a whole phase, the
+    timeline is restarted from the late edge instead of setting a phase of
+    zero length; such resyncs are counted.
+    """
+
+    def __init__(self, pulse_width, pause_width, start=None, spin=SPIN):
+        self.pulse_width = pulse_width
+        self.pause_width = pause_width
+        self.spin = spin
+        self.restart(start)
+
+    def restart(self, start=None):
+        """Starts the timeline over at start (default now), e.g. once setup is done."""
+        self.start = perf_counter() if start is None else start
+        self.in_pulse = False
+        self.next_edge = self.start + self.pause_width
+        self.phase_start = self.start
+        self.query_time = 0.0
+        self.set_time = 0.0
+        self.late = 0.0
+        self.pulse_time = 0.0
+        self.pause_time = 0.0
+        self.edges = 0
+        self.resyncs = 0
+        self.late_total = 0.0
+        self.late_max = 0.0
+
+    def record_query(self, duration):
+        """Updates the running average of the query latency."""
+        self.query_time = 0.9 * self.query_time + 0.1 * duration
+
+    @property
+    def set_deadline(self):
+        """When to start setting the next edge so it lands centred on time."""
+        return self.next_edge - self.set_time / 2
+
+    def should_wait(self, now):
+        """True if the next edge is due before a query started now returns."""
+        return now + self.query_time >= self.set_deadline
+
+    def wait(self):
+        wait_until(self.set_deadline, self.spin)
+
+    def advance(self, set_start, set_end):
+        """Books the edge set between set_start and set_end, returns the new phase.
+
+        The midpoint of the source command counts as the edge time; its
+        lateness against the schedule is kept in `late`.
+        """
+        self.set_time = 0.9 * self.set_time + 0.1 * (set_end - set_start)
+        set_time = (set_start + set_end) / 2
+        self.late = set_time - self.next_edge
+        self.late_total += abs(self.late)
+        self.late_max = max(self.late_max, self.late)
+        if self.in_pulse:
+            self.pulse_time += set_time - self.phase_start
+        else:
+            self.pause_time += set_time - self.phase_start
+        self.phase_start = set_time
+        self.in_pulse = not self.in_pulse
+        self.edges += 1
+        width = self.pulse_width if self.in_pulse else self.pause_width
+        self.next_edge += width
+        if self.next_edge <= set_time:
+            self.next_edge = set_time + width
+            self.resyncs += 1
+        return self.in_pulse
+
+    def close(self, end_time):
+        """Books the phase running at the end of the train."""
+        if self.in_pulse:
+            self.pulse_time += end_time - self.phase_start
+        else:
+            self.pause_time += end_time - self.phase_start
+        self.phase_start = end_time
+
+    @property
+    def requested_duty_cycle(self):
+        return self.pulse_width / (self.pulse_width + self.pause_width)
+
+    @property
+    def duty_cycle(self):
+        total = self.pulse_time + self.pause_time
+        return self.pulse_time / total if total else 0.0
+
+    def summary(self):
+        mean_late = self.late_total / self.edges if self.edges else 0.0
+        return (
+            f"{self.edges} edges, duty cycle {self.duty_cycle:.4f} "
+            f"(requested {self.requested_duty_cycle:.4f}), "
+            f"edge error mean {1000 * mean_late:.3f} ms, "
+            f"max late {1000 * self.late_max:.3f} ms, {self.resyncs} resyncs"
+        )
@@ -2,18 +2,14 @@
 
 """
 
-from email.policy import default
 import logging
 import sys
 import tempfile
 from time import sleep, perf_counter
-from matplotlib import pyplot as plt
 import numpy as np
 import random
-from pymeasure.instruments.keithley import Keithley2400
-from pymeasure.display.Qt import QtGui
-from PyQt5.QtCore import QLocale
 from pymeasure.display.windows import ManagedWindow
+from launcher import launch
 from pymeasure.experiment import (
     Procedure,
     FloatParameter,
@@ -147,8 +143,5 @@ class MainWindow(ManagedWindow):
 
 
 if __name__ == "__main__":
-    app = QtGui.QApplication(sys.argv)
-    QLocale.setDefault(QLocale(QLocale.English, QLocale.UnitedStates))
-    window = MainWindow()
-    window.show()
+    app, window = launch(MainWindow)
     sys.exit(app.exec_())
@@ -0,0 +1,61 @@
+"""
+Chunked reader for pymeasure results CSV files.
+
+The "#" header block written by pymeasure is skipped and the numeric columns
+are parsed by the pandas C parser straight into float64 arrays, chunk_rows
+rows at a time. Each chunk is handed to a reducer, so peak memory depends on
+the chunk size and the reducer instead of on the length of the run.
+
+A reducer has update(chunk), where chunk maps column names to arrays, and
+result().
+"""
+
+import numpy as np
+import pandas as pd
+
+CHUNK_ROWS = 200000
+
+
+def read_procedure(csvf):
+    """Returns the first header line, which names the procedure class."""
+    with open(csvf, "r", encoding="utf-8", errors="replace") as f:
+        return f.readline().strip()
+
+
+def iter_chunks(csvf, columns=None, chunk_rows=CHUNK_ROWS):
+    """Yields {column: float64 array} dicts of at most chunk_rows rows."""
+    reader = pd.read_csv(
+        csvf,
+        comment="#",
+        usecols=columns,
+        dtype=np.float64,
+        chunksize=chunk_rows,
+        engine="c",
+    )
+    with reader:
+        for frame in reader:
+            yield {name: frame[name].to_numpy() for name in frame.columns}
+
+
+def reduce_csv(csvf, reducer, columns=None, chunk_rows=CHUNK_ROWS):
+    for chunk in iter_chunks(csvf, columns, chunk_rows):
+        reducer.update(chunk)
+    return reducer.result()
+
+
+class ColumnCollector:
+    """Reducer that keeps the selected columns as typed arrays."""
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.parts = {name: [] for name in self.columns}
+
+    def update(self, chunk):
+        for name in self.columns:
+            self.parts[name].append(chunk[name])
+
+    def result(self):
+        return tuple(
+            np.concatenate(self.parts[name]) if self.parts[name] else np.empty(0)
+            for name in self.columns
+        )
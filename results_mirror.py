@@ -0,0 +1,156 @@
+"""
+Incremental mirror of a run folder to its final location during the run.
+
+ResultsMirror copies the run folder every `interval` seconds in a background
+thread. Files that only grew (results CSVs, full-rate files) get just the new
+bytes appended at the destination. Files that shrank or whose last mirrored
+bytes changed, like rewritten JSON files, are copied again in full.
+Several files are copied in parallel. finish() asks for a final pass, which
+repeats until nothing changes any more, then compares checksums of source and
+destination and copies again whatever differs. It does not block the caller,
+so the next experiment can start while the last bytes go to the share, and a
+crash loses at most the last interval.
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import threading
+from time import sleep
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+COPY_CHUNK = 1 << 20
+# Bytes before the mirrored size that must be unchanged to only append
+TAIL_CHECK = 4096
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(COPY_CHUNK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def tail_digest(path, size):
+    """Checksum of the TAIL_CHECK bytes of path before size."""
+    start = max(0, size - TAIL_CHECK)
+    with open(path, "rb") as f:
+        f.seek(start)
+        return hashlib.sha256(f.read(size - start)).digest()
+
+
+def append_tail(src, dst, offset):
+    """Appends src from offset on to dst, returns the number of bytes."""
+    copied = 0
+    with open(src, "rb") as fin, open(dst, "ab") as fout:
+        fin.seek(offset)
+        for block in iter(lambda: fin.read(COPY_CHUNK), b""):
+            fout.write(block)
+            copied += len(block)
+    return copied
+
+
+class ResultsMirror(threading.Thread):
+    def __init__(self, src, dst, interval=30, workers=4, final_passes=10, on_done=None):
+        super().__init__(name=f"{threading.current_thread().name} results mirror")
+        self.src = Path(src)
+        self.dst = Path(dst)
+        self.interval = interval
+        self.workers = workers
+        self.final_passes = final_passes
+        self.on_done = on_done
+        self.finishing = threading.Event()
+        # Relative path -> (size, mtime, tail digest) of the source when mirrored
+        self.state = {}
+        self.copied = 0
+        self.errors = 0
+
+    def _sync_file(self, rel, size, mtime):
+        src = self.src / rel
+        dst = self.dst / rel
+        done = self.state.get(rel)
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        if (
+            done is not None
+            and dst.is_file()
+            and size > done[0]
+            and tail_digest(src, done[0]) == done[2]
+        ):
+            copied = append_tail(src, dst, done[0])
+        else:
+            shutil.copyfile(src, dst)
+            copied = size
+        # The source may have grown while copying, continue from what arrived
+        mirrored = dst.stat().st_size
+        self.state[rel] = (mirrored, mtime, tail_digest(dst, mirrored))
+        return copied
+
+    def sync(self, pool):
+        """One pass over the source tree, returns the number of files updated."""
+        jobs = {}
+        for root, _, files in os.walk(self.src):
+            for name in files:
+                path = Path(root) / name
+                try:
+                    st = path.stat()
+                except OSError:
+                    continue
+                rel = path.relative_to(self.src)
+                if self.state.get(rel, ())[:2] != (st.st_size, st.st_mtime):
+                    jobs[rel] = pool.submit(
+                        self._sync_file, rel, st.st_size, st.st_mtime
+                    )
+        copied = 0
+        for rel, job in jobs.items():
+            try:
+                copied += job.result()
+            except OSError as e:
+                self.errors += 1
+                self.state.pop(rel, None)
+                log.warning(f"Mirroring {rel} failed: {e}")
+        self.copied += copied
+        return len(jobs)
+
+    def verify(self, pool):
+        """Copies again every file whose checksum differs, returns their count."""
+
+        def check(rel):
+            src = self.src / rel
+            dst = self.dst / rel
+            if dst.is_file() and file_digest(src) == file_digest(dst):
+                return False
+            shutil.copyfile(src, dst)
+            return True
+
+        return sum(pool.map(check, list(self.state)))
+
+    def run(self):
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while not self.finishing.wait(self.interval):
+                self.sync(pool)
+            # The recorder may still write the last rows
+            for _ in range(self.final_passes):
+                if not self.sync(pool):
+                    break
+                sleep(1)
+            try:
+                fixed = self.verify(pool)
+            except OSError as e:
+                log.warning(f"Verifying the mirror of {self.src} failed: {e}")
+                return
+        log.info(
+            f"Mirrored {self.src} to {self.dst}: {len(self.state)} files, "
+            f"{self.copied / 2**20:.1f} MB, {fixed} copied again after "
+            f"checksum mismatch, {self.errors} errors"
+        )
+        if self.on_done is not None:
+            self.on_done()
+
+    def finish(self):
+        """Starts the final pass and verification; does not wait for them."""
+        self.finishing.set()
@@ -0,0 +1,97 @@
+"""
+Compact sample history for long acquisition runs.
+
+Samples are written into preallocated NumPy chunks instead of Python lists.
+With max_chunks set the store is a ring buffer holding the newest
+max_chunks full chunks plus the one being filled, so memory stays flat no
+matter how long the run is. With spill_dir set every full chunk is also saved
+as .npy to disk before it can be dropped, so the whole run stays available.
+"""
+
+from collections import deque
+from pathlib import Path
+import numpy as np
+
+
+class SampleStore:
+    def __init__(
+        self,
+        columns,
+        chunk_size=65536,
+        max_chunks=None,
+        spill_dir=None,
+        dtype=np.float64,
+    ):
+        self.columns = list(columns)
+        self.chunk_size = chunk_size
+        self.max_chunks = max_chunks
+        self.spill_dir = None
+        if spill_dir is not None:
+            self.spill_dir = Path(spill_dir)
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+        self.chunks = deque()
+        self.spilled = []
+        self.current = np.empty((chunk_size, len(self.columns)), dtype=dtype)
+        self.fill = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def dropped(self):
+        """Number of samples that are neither in memory nor on disk."""
+        if self.spill_dir is not None:
+            return 0
+        return self.count - self.fill - len(self.chunks) * self.chunk_size
+
+    def append(self, *values):
+        """Adds one sample, values in column order."""
+        self.current[self.fill] = values
+        self.fill += 1
+        self.count += 1
+        if self.fill == self.chunk_size:
+            self._retire()
+
+    def append_block(self, *columns):
+        """Adds a block of samples given as one array per column."""
+        block = np.column_stack(columns)
+        start = 0
+        while start < len(block):
+            n = min(self.chunk_size - self.fill, len(block) - start)
+            self.current[self.fill : self.fill + n] = block[start : start + n]
+            self.fill += n
+            self.count += n
+            start += n
+            if self.fill == self.chunk_size:
+                self._retire()
+
+    def _retire(self):
+        chunk = self.current
+        if self.spill_dir is not None:
+            path = self.spill_dir / f"chunk_{len(self.spilled):05d}.npy"
+            np.save(path, chunk)
+            self.spilled.append(path)
+        self.chunks.append(chunk)
+        if self.max_chunks is not None and len(self.chunks) > self.max_chunks:
+            # Reuse the oldest chunk instead of allocating a new one
+            self.current = self.chunks.popleft()
+        else:
+            self.current = np.empty_like(chunk)
+        self.fill = 0
+
+    def data(self, include_spilled=False):
+        """Returns the history as one (samples, columns) array.
+
+        By default only the samples still in memory are returned; with
+        include_spilled the spilled chunks are read back from disk as well.
+        """
+        if include_spilled and self.spill_dir is not None:
+            parts = [np.load(path, mmap_mode="r") for path in self.spilled]
+        else:
+            parts = list(self.chunks)
+        parts.append(self.current[: self.fill])
+        return np.concatenate(parts)
+
+    def column(self, name, include_spilled=False):
+        return self.data(include_spilled)[:, self.columns.index(name)]
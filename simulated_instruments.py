@@ -0,0 +1,499 @@
+"""
+Simulated stand-ins for the instruments used by the procedures.
+
+They expose the parts of the pymeasure Keithley2400, Keithley2450,
+Keithley2600 (ChA/ChB) and HP34401A APIs the scripts use, including the
+instrument-timed list sweep (keithley2400_buffered) and TSP pulse train
+(keithley2600_buffered) modes. Every query waits a configurable latency with
+jitter, and currents come from a simple electrochemical cell model with noise,
+so acquisition loops can be profiled without the lab bench.
+
+Select them with the EP_SIMULATE environment variable, see instruments.py.
+"""
+
+import logging
+import math
+import random
+import re
+from contextlib import contextmanager
+from time import perf_counter
+import numpy as np
+from pulse_scheduler import wait_until
+
+log = logging.getLogger(__name__)
+
+LINE_FREQUENCY = 50
+POINT_OVERHEAD = 0.0005
+
+
+def wait(seconds):
+    """Sleeps, spinning for the last part so short latencies stay accurate."""
+    wait_until(perf_counter() + seconds)
+
+
+class CellModel:
+    """Series resistance in front of a charge transfer resistance || double layer.
+
+    For a constant source voltage over a step the capacitor voltage relaxes
+    exponentially, which is solved exactly per step. Units are V, A, Ohm, F.
+    """
+
+    def __init__(
+        self,
+        series_resistance=5.0,
+        transfer_resistance=50.0,
+        capacitance=1e-3,
+        open_voltage=0.0,
+        noise=1e-6,
+    ):
+        self.rs = series_resistance
+        self.rct = transfer_resistance
+        self.capacitance = capacitance
+        self.open_voltage = open_voltage
+        self.noise = noise
+        self.tau = capacitance * self.rs * self.rct / (self.rs + self.rct)
+        self.vc = open_voltage
+        self.voltage = 0.0
+        self.output = False
+        self.last = None
+        # (time, new level) of every source level change, for benchmarks
+        self.edges = []
+
+    def step(self, now):
+        """Advances the cell to now and returns the current."""
+        if self.last is not None and self.output:
+            dt = max(0.0, now - self.last)
+            v_inf = self.open_voltage + (self.voltage - self.open_voltage) * (
+                self.rct / (self.rs + self.rct)
+            )
+            self.vc = v_inf + (self.vc - v_inf) * math.exp(-dt / self.tau)
+        elif not self.output:
+            self.vc = self.open_voltage
+        self.last = now
+        if not self.output:
+            return random.gauss(0, self.noise)
+        return (self.voltage - self.vc) / self.rs + random.gauss(0, self.noise)
+
+    def set_voltage(self, voltage, now):
+        self.step(now)
+        if voltage != self.voltage:
+            self.edges.append((now, voltage))
+        self.voltage = voltage
+
+    def set_output(self, output, now):
+        self.step(now)
+        self.output = output
+
+
+class SimulatedConnection:
+    def __init__(self, instrument):
+        self.instrument = instrument
+        self.timeout = 2000
+
+    def clear(self):
+        self.instrument.clear()
+
+    def write(self, command):
+        self.instrument.write(command)
+
+    def read_raw(self):
+        return self.instrument.read_raw()
+
+    @contextmanager
+    def read_termination_context(self, termination):
+        yield
+
+
+class SimulatedAdapter:
+    def __init__(self, instrument):
+        self.connection = SimulatedConnection(instrument)
+
+
+class SimulatedInstrument:
+    IDN = "SIMULATED,INSTRUMENT,0,0"
+
+    def __init__(self, adapter=None, latency=0.002, jitter=0.0005, **cell):
+        self.address = adapter
+        self.latency = latency
+        self.jitter = jitter
+        self.adapter = SimulatedAdapter(self)
+        self.cell_kwargs = cell
+        # Data format and answer of the raw fast-path reads, see fast_read.py
+        self.binary = False
+        self.response = []
+        self.reset()
+
+    def query_delay(self, extra=0):
+        wait(self.latency + extra + random.uniform(0, self.jitter))
+
+    def reset(self):
+        pass
+
+    def clear(self):
+        pass
+
+    def write(self, command):
+        self.query_delay()
+
+    def ask(self, command):
+        self.query_delay()
+        if command.strip() == "*IDN?":
+            return self.IDN
+        return "0"
+
+    def values(self, command):
+        return [float(v) for v in self.ask(command).split(",")]
+
+    def read_raw(self):
+        values, self.response = self.response, []
+        if self.binary:
+            return b"#0" + np.asarray(values, dtype="<f4").tobytes() + b"\n"
+        return (",".join(f"{v:.7e}" for v in values) + "\n").encode()
+
+    def shutdown(self):
+        log.info(f"Shut down simulated {self.__class__.__name__}")
+
+
+class SimulatedKeithley2400(SimulatedInstrument):
+    IDN = "KEITHLEY INSTRUMENTS INC.,MODEL 2400,0000000,C32 SIMULATED"
+
+    def reset(self):
+        self.cell = CellModel(**self.cell_kwargs)
+        self.measure_concurent_functions = False
+        self.current_nplc = 1
+        self.voltage_nplc = 1
+        self.compliance_current = 0.105
+        self.current_range = 0.105
+        self.source_delay = 0
+        self.output_off_state = "NORM"
+        self.source_mode = "voltage"
+        self.source_list = []
+        self.list_mode = False
+        self.arm_count = 1
+        self.trigger_count = 1
+        self.trigger_delay = 0
+        self.time_zero = perf_counter()
+        self.sweep_start = None
+        self.sweep_end = None
+        self.trace = None
+
+    # Source control
+    @property
+    def source_voltage(self):
+        return self.cell.voltage
+
+    @source_voltage.setter
+    def source_voltage(self, voltage):
+        self.query_delay()
+        self.cell.set_voltage(voltage, perf_counter())
+
+    def enable_source(self):
+        self.query_delay()
+        self.cell.set_output(True, perf_counter())
+
+    def disable_source(self):
+        self.query_delay()
+        self.cell.set_output(False, perf_counter())
+
+    def apply_voltage(self, *args, **kwargs):
+        self.source_mode = "voltage"
+
+    def apply_current(self, *args, **kwargs):
+        self.source_mode = "current"
+
+    def use_rear_terminals(self):
+        pass
+
+    def use_front_terminals(self):
+        pass
+
+    # Measurements
+    def measure_time(self):
+        return self.current_nplc / LINE_FREQUENCY + POINT_OVERHEAD
+
+    def _current(self, now):
+        limit = self.compliance_current
+        return min(max(self.cell.step(now), -limit), limit)
+
+    @property
+    def current(self):
+        self.query_delay(self.measure_time())
+        current = self._current(perf_counter())
+        if self.measure_concurent_functions:
+            return self.cell.voltage, current
+        return current
+
+    @property
+    def voltage(self):
+        self.query_delay(self.measure_time())
+        if self.source_mode == "current":
+            return self.cell.open_voltage + random.gauss(0, self.cell.noise)
+        return self.cell.voltage
+
+    # SCPI subset used by keithley2400_buffered
+    def write(self, command):
+        super().write(command)
+        command = command.strip().upper()
+        argument = command.split(" ", 1)[-1]
+        now = perf_counter()
+        if command.startswith(":SOUR:VOLT:LEV"):
+            self.cell.set_voltage(float(argument), now)
+        elif command.startswith(":SOUR:VOLT:MODE"):
+            self.list_mode = argument == "LIST"
+        elif command.startswith(":SOUR:LIST:VOLT"):
+            self.source_list = [float(v) for v in argument.split(",")]
+        elif command.startswith(":ARM:COUN"):
+            self.arm_count = int(argument)
+        elif command.startswith(":TRIG:COUN"):
+            self.trigger_count = int(argument)
+        elif command.startswith(":TRIG:DEL"):
+            self.trigger_delay = float(argument)
+        elif command.startswith(":SYST:TIME:RES"):
+            self.time_zero = now
+        elif command.startswith(":INIT"):
+            points = self.arm_count * self.trigger_count
+            self.sweep_start = now
+            self.sweep_end = now + points * (self.trigger_delay + self.measure_time())
+            self.trace = None
+        elif command.startswith(":ABOR"):
+            self.sweep_end = now
+        elif command.startswith(":OUTP"):
+            self.cell.set_output(argument in ("ON", "1"), now)
+        elif command.startswith(":FORM:DATA"):
+            self.binary = not argument.startswith("ASC")
+        elif command.startswith(":READ?"):
+            wait(self.measure_time())
+            current = self._current(perf_counter())
+            if "SOUR" in command or self.measure_concurent_functions:
+                self.response = [self.cell.voltage, current]
+            else:
+                self.response = [current]
+
+    def ask(self, command):
+        command = command.strip().upper()
+        if command == "*OPC?":
+            if self.sweep_end is not None:
+                wait(max(0, self.sweep_end - perf_counter()))
+                if self.trace is None:
+                    self.trace = self._acquire()
+            self.query_delay()
+            return "1"
+        if command == ":TRAC:DATA?":
+            if self.trace is None:
+                self.trace = self._acquire()
+            points = len(self.trace) // 3
+            # ~25 characters per reading and element at 1 MB/s
+            self.query_delay(points * 75e-6)
+            return ",".join(f"{v:.7e}" for v in self.trace)
+        return super().ask(command)
+
+    def _acquire(self):
+        """Readings of the last sweep, evaluated once it has run."""
+        points = self.arm_count * self.trigger_count
+        period = self.trigger_delay + self.measure_time()
+        times = self.sweep_start + np.arange(1, points + 1) * period
+        currents = np.empty(points)
+        if not self.list_mode:
+            levels = np.full(points, self.cell.voltage)
+            for k, now in enumerate(times):
+                currents[k] = self._current(now)
+        else:
+            levels = np.tile(self.source_list, self.arm_count)[:points]
+            for k, (level, now) in enumerate(zip(levels, times)):
+                self.cell.set_voltage(level, now - period)
+                currents[k] = self._current(now)
+            self.cell.set_voltage(self.source_list[-1], times[-1])
+        block = np.column_stack([levels, currents, times - self.time_zero])
+        return block.ravel()
+
+
+class SimulatedKeithley2450(SimulatedKeithley2400):
+    IDN = "KEITHLEY INSTRUMENTS,MODEL 2450,00000000,1.7.0 SIMULATED"
+
+
+class SimulatedChannel:
+    def __init__(self, instrument, channel):
+        self.instrument = instrument
+        self.channel = channel
+        self.cell = CellModel(**instrument.cell_kwargs)
+        self.compliance_current = 0.1
+        self.nplc = 0.001
+
+    def write(self, command):
+        self.instrument.query_delay()
+        match = re.match(r"\s*measure\.nplc\s*=\s*([0-9.eE+-]+)", command)
+        if match:
+            self.nplc = float(match.group(1))
+
+    def ask(self, command):
+        self.instrument.query_delay()
+        return 0.0
+
+    def measure_time(self):
+        return self.nplc / LINE_FREQUENCY + POINT_OVERHEAD
+
+    @property
+    def source_voltage(self):
+        return self.cell.voltage
+
+    @source_voltage.setter
+    def source_voltage(self, voltage):
+        self.instrument.query_delay()
+        self.cell.set_voltage(voltage, perf_counter())
+
+    @property
+    def source_output(self):
+        return "ON" if self.cell.output else "OFF"
+
+    @source_output.setter
+    def source_output(self, state):
+        self.instrument.query_delay()
+        self.cell.set_output(state in ("ON", 1, True), perf_counter())
+
+    def measure_current(self):
+        limit = self.compliance_current
+        return min(max(self.cell.step(perf_counter()), -limit), limit)
+
+    @property
+    def current(self):
+        self.instrument.query_delay(self.measure_time())
+        return self.measure_current()
+
+
+class SimulatedKeithley2600(SimulatedInstrument):
+    IDN = "Keithley Instruments Inc., Model 2602B, 0000000, 4.0.0 SIMULATED"
+
+    def reset(self):
+        self.ChA = SimulatedChannel(self, "a")
+        self.ChB = SimulatedChannel(self, "b")
+        self.train = None
+        self.pending = []
+
+    def clear(self):
+        self.train = None
+        self.pending = []
+
+    def write(self, command):
+        super().write(command)
+        match = re.match(r"\s*ep_pulse_train\(smu(\w),(.*)\)", command)
+        if match:
+            args = [float(v) for v in match.group(2).split(",")]
+            channel = self.ChA if match.group(1) == "a" else self.ChB
+            self._start_train(channel, *args)
+        match = re.match(r"\s*format\.data\s*=\s*format\.(\w+)", command)
+        if match:
+            self.binary = match.group(1) != "ASCII"
+        # Fast-path reads, see fast_read.py: locals of smuX.measure calls
+        # and a printnumber of locals or measure calls
+        local = {}
+        assignments = re.findall(
+            r"local\s+([\w\s,]+?)\s*=\s*(smu\w\.[\w.]+\(\))", command
+        )
+        for names, expression in assignments:
+            values = self._print_values(expression)
+            local.update(zip([n.strip() for n in names.split(",")], values))
+        match = re.search(r"printnumber\((.*)\)", command)
+        if match:
+            self.response = []
+            for expression in match.group(1).split(","):
+                expression = expression.strip()
+                if expression in local:
+                    self.response.append(local[expression])
+                else:
+                    self.response += self._print_values(expression)
+
+    def _print_values(self, expression):
+        channel = self.ChA if expression.startswith("smua") else self.ChB
+        if expression.endswith("measure.i()"):
+            wait(channel.measure_time())
+            return [channel.measure_current()]
+        if expression.endswith("measure.iv()"):
+            wait(channel.measure_time())
+            return [channel.measure_current(), channel.cell.voltage]
+        if expression.endswith("source.levelv"):
+            return [channel.cell.voltage]
+        return [0.0]
+
+    def _start_train(
+        self,
+        channel,
+        pulse_v,
+        pulse_w,
+        pause_v,
+        pause_w,
+        total_t,
+        chunk,
+        flush_t,
+        measure_v=0,
+    ):
+        self.train = {
+            "channel": channel,
+            "levels": (pause_v, pulse_v),
+            "widths": (pause_w, pulse_w),
+            "total": total_t,
+            "chunk": int(chunk),
+            "flush": flush_t,
+            "start": perf_counter(),
+            "t": 0.0,
+        }
+        channel.cell.set_voltage(pause_v, perf_counter())
+        channel.cell.set_output(True, perf_counter())
+
+    def _level(self, t):
+        pause_w, pulse_w = self.train["widths"]
+        if t < pause_w:
+            return self.train["levels"][0]
+        in_pulse = (t - pause_w) % (pulse_w + pause_w) < pulse_w
+        return self.train["levels"][int(in_pulse)]
+
+    def read(self):
+        if self.pending:
+            return self.pending.pop(0)
+        train = self.train
+        if train is None or train["t"] >= train["total"]:
+            self.train = None
+            return "EP_END"
+        channel = train["channel"]
+        period = channel.measure_time()
+        count = min(train["chunk"], max(1, int(train["flush"] / period)))
+        t0 = train["t"]
+        times = t0 + np.arange(count) * period
+        times = times[times < train["total"]]
+        wait(max(0, train["start"] + times[-1] - perf_counter()))
+        levels = np.array([self._level(t) for t in times])
+        currents = np.empty(len(times))
+        for k, (level, t) in enumerate(zip(levels, times)):
+            channel.cell.set_voltage(level, train["start"] + t - period)
+            currents[k] = channel.cell.step(train["start"] + t)
+        train["t"] = times[-1] + period
+        block = np.column_stack([times - t0, currents, levels])
+        self.pending.append(",".join(f"{v:.7e}" for v in block.ravel()))
+        return f"{t0:.7e}"
+
+
+class SimulatedHP34401A(SimulatedInstrument):
+    IDN = "HEWLETT-PACKARD,34401A,0,11-5-2 SIMULATED"
+
+    def reset(self):
+        self.cell = CellModel(**self.cell_kwargs)
+        self.nplc = 10
+
+    def write(self, command):
+        super().write(command)
+        match = re.search(r"NPLC\s+([0-9.eE+-]+)", command.upper())
+        if match:
+            self.nplc = float(match.group(1))
+
+    def ask(self, command):
+        if command.strip().upper() == ":READ?":
+            self.query_delay(self.nplc / LINE_FREQUENCY)
+            return f"{self.cell.open_voltage + random.gauss(0, self.cell.noise):+.8E}\n"
+        return super().ask(command)
+
+
+SIMULATED = {
+    "Keithley2400": SimulatedKeithley2400,
+    "Keithley2450": SimulatedKeithley2450,
+    "Keithley2600": SimulatedKeithley2600,
+    "HP34401A": SimulatedHP34401A,
+}
@@ -1,20 +1,197 @@
-import requests
+"""
+Telegram notifications about running experiments.
+
+The procedures use one long-lived Notifier per app (get_notifier()). send()
+only queues the message; a background thread delivers it over a pooled HTTP
+session with retry and exponential backoff, so notifications never block an
+experiment or its shutdown. Pending ETA messages are coalesced, only the
+newest one is sent. progress() turns the done fraction (time or charge) into
+an ETA message at most every eta_interval seconds.
+
+Token and chat id are read once from keyfile.txt; without it notifications
+are disabled. base_url can point to a local HTTP stand-in for testing.
+
+    python telegram_sender.py START|ETA|FINISHED [text]
+"""
+
+import atexit
+import logging
 import sys
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from time import monotonic, sleep
+
+log = logging.getLogger(__name__)
+
+API_URL = "https://api.telegram.org"
+MESSAGES = {
+    "START": "Experiment successfully started",
+    "ETA": "Experiment running",
+    "FINISHED": "Experiment finished",
+}
+
+
+def read_keyfile(keyfile="keyfile.txt"):
+    """Returns (token, chatid) from the key file, or None if there is none."""
+    try:
+        with open(keyfile, "r", encoding="utf-8") as f:
+            token, chatid = f.read().splitlines()[:2]
+    except (OSError, ValueError):
+        return None
+    return token, chatid
+
+
+class Notifier:
+    def __init__(
+        self,
+        token=None,
+        chatid=None,
+        base_url=API_URL,
+        retries=4,
+        backoff=2.0,
+        timeout=10,
+        eta_interval=1800,
+    ):
+        self.token = token
+        self.chatid = chatid
+        self.enabled = token is not None
+        self.base_url = base_url.rstrip("/")
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.eta_interval = eta_interval
+        self.pending = deque()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.thread = None
+        self.sent = 0
+        self.failed = 0
+        self.progress_start = None
+        self.last_eta = None
+
+    def send(self, kind, text=None):
+        """Queues a message; pending ETA messages are replaced by a new one."""
+        if not self.enabled:
+            return
+        if kind not in MESSAGES:
+            raise NotImplementedError("Not implemented what you're trying")
+        with self.condition:
+            if kind == "START":
+                # A new run, the ETA is extrapolated from its own progress
+                self.progress_start = None
+                self.last_eta = None
+            if kind == "ETA":
+                self.pending = deque(m for m in self.pending if m[0] != "ETA")
+            self.pending.append((kind, text or MESSAGES[kind]))
+            self.condition.notify()
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self._run, name="notifier", daemon=True
+                )
+                self.thread.start()
+
+    def progress(self, fraction):
+        """Sends an ETA, extrapolated from the progress since the first call."""
+        if not self.enabled:
+            return
+        now = monotonic()
+        with self.condition:
+            if self.progress_start is None:
+                self.progress_start = (now, fraction)
+                self.last_eta = now
+                return
+            start, start_fraction = self.progress_start
+            if now - self.last_eta < self.eta_interval or fraction <= start_fraction:
+                return
+            self.last_eta = now
+        remaining = (now - start) * (1 - fraction) / (fraction - start_fraction)
+        finish = datetime.now() + timedelta(seconds=remaining)
+        self.send(
+            "ETA",
+            f"{100 * fraction:.0f}% done, ETA {finish:%H:%M} "
+            f"({remaining / 60:.0f} min left)",
+        )
+
+    def _run(self):
+        # Imported here so the GUI does not pay for requests at startup
+        import requests
+
+        session = requests.Session()
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                if not self.pending:
+                    break
+                kind, text = self.pending.popleft()
+            if self._deliver(session, text):
+                self.sent += 1
+            else:
+                self.failed += 1
+                log.warning(f"Could not send {kind} notification")
+        session.close()
+
+    def _deliver(self, session, text):
+        import requests
+
+        url = f"{self.base_url}/bot{self.token}/sendMessage"
+        params = {"chat_id": self.chatid, "text": text}
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            if attempt:
+                sleep(delay)
+                delay *= 2
+            try:
+                response = session.get(url, params=params, timeout=self.timeout)
+            except requests.RequestException as e:
+                log.debug(f"Notification attempt {attempt + 1} failed: {e}")
+                continue
+            if response.status_code == 429:
+                try:
+                    retry_after = response.json()["parameters"]["retry_after"]
+                    delay = max(delay, float(retry_after))
+                except (ValueError, KeyError, TypeError):
+                    pass
+                continue
+            if response.status_code >= 500:
+                continue
+            return response.ok
+        return False
+
+    def close(self, timeout=5):
+        """Delivers what is pending for at most timeout seconds."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+
+_notifier = None
+_notifier_lock = threading.Lock()
 
 
-def get_message_url(token, chatid, message):
-    return f"https://api.telegram.org/bot{token}/sendMessage?chat_id={chatid}&text={message}"
+def get_notifier(keyfile="keyfile.txt"):
+    """The notifier shared by all experiments of this process."""
+    global _notifier
+    with _notifier_lock:
+        if _notifier is None:
+            keys = read_keyfile(keyfile)
+            if keys is None:
+                log.info(f"No {keyfile}, notifications are disabled")
+                _notifier = Notifier()
+            else:
+                _notifier = Notifier(*keys)
+                atexit.register(_notifier.close, 2)
+        return _notifier
 
 
 if __name__ == "__main__":
-    with open("keyfile.txt", "r", encoding="utf-8") as f:
-        token, chatid = f.read().splitlines()
-    if sys.argv[1] not in ["START", "ETA", "FINISHED"]:
-        raise NotImplementedError("Not implemented what you're trying")
-    if sys.argv[1] == "FINISHED":
-        message = "Experiment finished"
-        url = get_message_url(token, chatid, message)
-    if sys.argv[1] == "START":
-        message = "Experiment successfully started"
-        url = get_message_url(token, chatid, message)
-    requests.get(url).json()
+    keys = read_keyfile()
+    if keys is None:
+        raise FileNotFoundError("keyfile.txt with token and chat id is missing")
+    notifier = Notifier(*keys)
+    notifier.send(sys.argv[1], " ".join(sys.argv[2:]) or None)
+    notifier.close(timeout=None)
+    sys.exit(0 if notifier.sent else 1)
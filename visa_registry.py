@@ -0,0 +1,212 @@
+"""
+Finds instruments on the VISA bus by identity instead of by bus order.
+
+VisaRegistry probes all VISA resources concurrently with a short timeout and
+maps the *IDN? answer (vendor, model, serial) to the address. The mapping is
+kept in visa_cache.json; a cached address is revalidated with a single *IDN?
+before it is used, so a known instrument is found in milliseconds and dead
+addresses never cost a sequential timeout. Serial ports are not probed unless
+asked for, since unknown serial devices may not like an *IDN? query.
+
+Probes, scans and instrument.open_instrument() all hold the registry lock, so
+a background revalidation never talks to an address while a run opens it.
+Addresses with an open instrument are not probed at all. Across processes,
+every probe takes an exclusive VISA lock first, and open_instrument() holds
+one for the lifetime of the instrument: an address another process (a second
+GUI, the HP logger) is driving cannot be locked, it is skipped and keeps its
+cached identity instead of getting an *IDN? in the middle of a transaction.
+
+    python gpibtest.py [--rescan]
+"""
+
+import json
+import logging
+import re
+import threading
+import weakref
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from instruments import list_resources, resource_manager
+
+log = logging.getLogger(__name__)
+
+CACHE_FILE = "visa_cache.json"
+
+# Regular expressions on the model field of *IDN? per supported model
+MODEL_PATTERNS = {
+    "Keithley2400": r"(MODEL )?24[0-4]\d\b",
+    "Keithley2450": r"(MODEL )?24[5-7]\d\b",
+    "Keithley2600": r"(MODEL )?26\d\d",
+    "HP34401A": r"34401A",
+}
+
+
+def parse_idn(idn):
+    """Splits an *IDN? answer into a dict with vendor, model, serial, firmware."""
+    fields = [f.strip() for f in idn.strip().split(",")]
+    fields += [""] * (4 - len(fields))
+    return dict(zip(["vendor", "model", "serial", "firmware"], fields[:4]))
+
+
+# probe() result of an address that is locked by another session
+LOCKED = "locked"
+
+
+def probe(address, timeout=0.3):
+    """Returns the *IDN? answer of address, None if nothing answers.
+
+    Returns LOCKED without querying if address cannot be locked exclusively
+    within timeout.
+    """
+    try:
+        inst = resource_manager().open_resource(
+            address, open_timeout=int(1000 * timeout)
+        )
+    except Exception as e:
+        log.debug(f"Opening {address} failed: {e}")
+        return None
+    try:
+        inst.timeout = int(1000 * timeout)
+        try:
+            inst.lock_excl(int(1000 * timeout))
+        except Exception as e:
+            log.info(f"Not probing {address}, it is locked by another session: {e}")
+            return LOCKED
+        try:
+            return inst.query("*IDN?").strip()
+        finally:
+            inst.unlock()
+    except Exception as e:
+        log.debug(f"*IDN? on {address} failed: {e}")
+        return None
+    finally:
+        inst.close()
+
+
+class VisaRegistry:
+    def __init__(self, cache_file=CACHE_FILE, timeout=0.3, workers=16, serial=False):
+        self.cache_file = Path(cache_file)
+        self.timeout = timeout
+        self.workers = workers
+        self.serial = serial
+        self.lock = threading.RLock()
+        # Address -> parsed *IDN?
+        self.entries = {}
+        # Address -> number of live instruments opened on it
+        self.open = Counter()
+        if self.cache_file.is_file():
+            try:
+                with open(self.cache_file, "r", encoding="utf-8") as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError) as e:
+                log.warning(f"Ignoring unreadable {self.cache_file}: {e}")
+
+    def save(self):
+        with open(self.cache_file, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, indent=1)
+
+    def mark_open(self, address, instrument):
+        """Keeps probes away from address as long as instrument is alive."""
+        with self.lock:
+            self.open[address] += 1
+        weakref.finalize(instrument, self.release, address)
+
+    def release(self, address):
+        with self.lock:
+            self.open[address] -= 1
+            if self.open[address] <= 0:
+                del self.open[address]
+
+    def _probe_all(self, addresses):
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            answers = pool.map(lambda a: probe(a, self.timeout), addresses)
+            return dict(zip(addresses, answers))
+
+    def scan(self):
+        """Probes every resource on the bus concurrently and updates the cache.
+
+        Open and locked addresses are not probed and keep their cached identity.
+        """
+        with self.lock:
+            addresses = [
+                a
+                for a in list_resources(refresh=True)
+                if (self.serial or not a.startswith("ASRL")) and a not in self.open
+            ]
+            answers = self._probe_all(addresses)
+            entries = {
+                address: parse_idn(idn)
+                for address, idn in answers.items()
+                if idn and idn != LOCKED
+            }
+            kept = list(self.open)
+            kept += [a for a, idn in answers.items() if idn == LOCKED]
+            for address in kept:
+                if address in self.entries:
+                    entries[address] = self.entries[address]
+            self.entries = entries
+            self.save()
+        log.info(f"Found {len(self.entries)} instruments on {len(addresses)} addresses")
+        return self.entries
+
+    def revalidate(self):
+        """Probes the cached addresses and drops those with another identity.
+
+        Locked addresses are kept.
+        """
+        with self.lock:
+            addresses = [a for a in self.entries if a not in self.open]
+            answers = self._probe_all(addresses)
+            for address, idn in answers.items():
+                if idn == LOCKED:
+                    continue
+                if idn is None or not self._same(self.entries[address], idn):
+                    del self.entries[address]
+            self.save()
+        return self.entries
+
+    @staticmethod
+    def _same(entry, idn):
+        new = parse_idn(idn)
+        return (new["model"], new["serial"]) == (entry["model"], entry["serial"])
+
+    def matches(self, model):
+        """Cached addresses whose identity fits model ("Keithley2600", ...)."""
+        pattern = re.compile(MODEL_PATTERNS[model], re.IGNORECASE)
+        return [a for a, e in self.entries.items() if pattern.match(e["model"])]
+
+    def address(self, model):
+        """Address of model, from the cache if it still answers, else by a scan.
+
+        An address that is open already is known to be there and not probed;
+        one locked by another session is in use there and skipped.
+        """
+        with self.lock:
+            for address in self.matches(model):
+                if address in self.open:
+                    return address
+                idn = probe(address, self.timeout)
+                if idn == LOCKED:
+                    continue
+                if idn is not None and self._same(self.entries[address], idn):
+                    return address
+            self.scan()
+            found = self.matches(model)
+        if not found:
+            raise LookupError(f"No {model} found on the VISA bus")
+        if len(found) > 1:
+            log.warning(f"Several {model} found: {found}, using {found[0]}")
+        return found[0]
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = VisaRegistry()
+        return _registry